@@ -0,0 +1,202 @@
+import numpy as np
+import pandas as pd
+from utils import PERIODS, get_match_index, get_weights
+
+DIMENSIONS = ['competition', 'team', 'player', 'match', 'period', 'event_name', 'sub_event_name']
+
+# above this number of possible keys, the packed keys are grouped with np.unique instead of np.bincount
+MAX_DENSE_KEYS = 2 ** 24
+
+def _pack(keys):
+    """
+    Pack the columns of the keys into a single int64 key, in mixed radix: each
+    column, shifted by its minimum, is multiplied by the product of the ranges
+    of the following columns. If the packed keys would not fit in an int64,
+    the columns are first replaced by the ranks of their values.
+
+    Returns
+    -------
+    tuple
+        the packed keys, the number of possible packed keys and a function
+        converting packed keys back to the columns of the keys
+    """
+    columns = [column for column in keys.T]
+    offsets = [int(column.min()) for column in columns]
+    radices = [int(column.max()) - offset + 1 for column, offset in zip(columns, offsets)]
+    values = [None] * len(columns)
+    if np.prod(radices, dtype=np.float64) >= 2 ** 62:
+        for i, column in enumerate(columns):
+            values[i], columns[i] = np.unique(column, return_inverse=True)
+            offsets[i], radices[i] = 0, len(values[i])
+
+    packed = np.zeros(len(keys), dtype=np.int64)
+    for column, offset, radix in zip(columns, offsets, radices):
+        packed = packed * radix + (column.ravel() - offset)
+
+    def unpack(packed):
+        columns = np.empty((len(packed), len(radices)), dtype=np.int64)
+        for i in reversed(range(len(radices))):
+            packed, column = np.divmod(packed, radices[i])
+            columns[:, i] = column + offsets[i] if values[i] is None else values[i][column]
+        return columns
+
+    return packed, int(np.prod(radices, dtype=np.float64)), unpack
+
+def _group(keys, measures):
+    """
+    Sum the measures of the rows with the same keys. The keys are packed into
+    a single int64 column, then grouped with np.bincount when there are few
+    possible packed keys, or with np.unique otherwise.
+    """
+    if len(keys) == 0:
+        return keys, [measure[:0] for measure in measures]
+    packed, n_keys, unpack = _pack(keys)
+    if n_keys <= max(MAX_DENSE_KEYS, len(packed)):
+        is_group = np.bincount(packed, minlength=n_keys) > 0
+        groups = np.flatnonzero(is_group)
+        rows = (np.cumsum(is_group) - 1)[packed]
+    else:
+        groups, rows = np.unique(packed, return_inverse=True)
+        rows = rows.ravel()
+    return unpack(groups), [np.bincount(rows, weights=measure, minlength=len(groups)).astype(measure.dtype)
+                            for measure in measures]
+
+class AggregateCube(object):
+    """
+    Number of events and sum of the zone weights (utils.get_weight) for each
+    combination of competition, team, player, match, period, eventName and
+    subEventName. The cube is built with a single vectorized group-by over
+    the columnar events and can be extended with new matches, saved and loaded.
+    Roll-up and slice queries are answered by grouping the rows of the cube,
+    which are far fewer than the events, on a single packed int64 key.
+    """
+    def __init__(self):
+        self.keys = np.empty((0, len(DIMENSIONS)), dtype=np.int64)
+        self.count = np.empty(0, dtype=np.int64)
+        self.zone_weight = np.empty(0, dtype=np.float64)
+        self.event_names, self.sub_event_names = [], []
+
+    def _encode(self, names, vocabulary):
+        """
+        Map the names to their positions in the vocabulary of the cube, adding the new ones.
+        """
+        codes = []
+        for name in names:
+            name = str(name)
+            if name not in vocabulary:
+                vocabulary.append(name)
+            codes.append(vocabulary.index(name))
+        return np.array(codes, dtype=np.int64)
+
+    def append(self, event_arrays, match_id2match, zone_weights=None):
+        """
+        Add the events of new matches to the cube. The rows of the matches already
+        in the cube are replaced, so that reloading a round overlapping the previous
+        data does not count its events twice.
+
+        Parameters
+        ----------
+        event_arrays : dict
+            the columnar events, as returned by utils.get_event_arrays
+
+        match_id2match : dict
+            a dictionary of match identifiers to matches, used for the competitions
+
+        zone_weights : numpy.ndarray, optional
+            the zone weight of each event. Default: utils.get_weights of the start positions
+        """
+        if zone_weights is None:
+            zone_weights = get_weights(np.nan_to_num(event_arrays['position_x'][:, 0], nan=-1).astype(int),
+                                       np.nan_to_num(event_arrays['position_y'][:, 0], nan=-1).astype(int))
+        competitions = np.array([match_id2match[match_id]['competitionId'] if match_id in match_id2match else -1
+                                 for match_id in event_arrays['match_ids']], dtype=np.int64)
+        event_names = self._encode(event_arrays['event_names'], self.event_names)
+        sub_event_names = self._encode(event_arrays['sub_event_names'], self.sub_event_names)
+
+        keys = np.column_stack([
+            competitions[get_match_index(event_arrays)],
+            event_arrays['team_id'],
+            event_arrays['player_id'],
+            event_arrays['match_id'],
+            event_arrays['period'],
+            event_names[event_arrays['event_name']],
+            sub_event_names[event_arrays['sub_event_name']]
+        ]).astype(np.int64)
+        measures = [np.ones(len(keys), dtype=np.int64), np.asarray(zone_weights, dtype=np.float64)]
+        keys, (count, zone_weight) = _group(keys, measures)
+
+        keep = ~np.isin(self.keys[:, DIMENSIONS.index('match')], event_arrays['match_ids'])
+        self.keys, (self.count, self.zone_weight) = _group(
+            np.concatenate([self.keys[keep], keys]),
+            [np.concatenate([self.count[keep], count]), np.concatenate([self.zone_weight[keep], zone_weight])])
+        return self
+
+    def _code(self, dimension, value):
+        if dimension == 'period':
+            return PERIODS.index(value) if isinstance(value, str) else value
+        if dimension == 'event_name':
+            return self.event_names.index(value) if value in self.event_names else -1
+        if dimension == 'sub_event_name':
+            return self.sub_event_names.index(value) if value in self.sub_event_names else -1
+        return value
+
+    def query(self, group_by=(), **filters):
+        """
+        Count the events and sum their zone weights, grouped by some dimensions,
+        for the rows of the cube satisfying the filters.
+
+        Parameters
+        ----------
+        group_by : list, optional
+            the dimensions to group by (see DIMENSIONS). Default: no grouping
+
+        filters : optional
+            for each dimension, the value or the list of values to keep, e.g.
+            team=3161, period='1H', event_name=['Pass', 'Shot']
+
+        Returns
+        -------
+        pandas.DataFrame
+            a row per group, with the dimensions and the columns 'count' and 'zone_weight'
+        """
+        group_by = list(group_by)
+        keys = self.keys[:, [DIMENSIONS.index(dimension) for dimension in group_by]]
+        measures = [self.count, self.zone_weight]
+        if filters:
+            mask = np.ones(len(self.keys), dtype=bool)
+            for dimension, values in filters.items():
+                values = values if isinstance(values, (list, tuple, set, np.ndarray)) else [values]
+                codes = [self._code(dimension, value) for value in values]
+                mask &= np.isin(self.keys[:, DIMENSIONS.index(dimension)], codes)
+            keys, measures = keys[mask], [measure[mask] for measure in measures]
+        groups, (count, zone_weight) = _group(keys, measures)
+        df = pd.DataFrame(groups, columns=group_by)
+        if 'period' in group_by:
+            df['period'] = np.array(PERIODS)[df['period'].values]
+        if 'event_name' in group_by:
+            df['event_name'] = np.array(self.event_names, dtype=object)[df['event_name'].values]
+        if 'sub_event_name' in group_by:
+            df['sub_event_name'] = np.array(self.sub_event_names, dtype=object)[df['sub_event_name'].values]
+        df['count'] = count
+        df['zone_weight'] = zone_weight
+        return df
+
+    def save(self, file_name):
+        """
+        Save the cube in a compressed .npz file.
+        """
+        np.savez_compressed(file_name, keys=self.keys, count=self.count, zone_weight=self.zone_weight,
+                            event_names=np.array(self.event_names, dtype=str),
+                            sub_event_names=np.array(self.sub_event_names, dtype=str))
+
+    @classmethod
+    def load(cls, file_name):
+        """
+        Load a cube saved with save.
+        """
+        cube = cls()
+        with np.load(file_name) as data:
+            cube.keys, cube.count, cube.zone_weight = data['keys'], data['count'], data['zone_weight']
+            cube.event_names = [str(name) for name in data['event_names']]
+            cube.sub_event_names = [str(name) for name in data['sub_event_names']]
+        return cube
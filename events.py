@@ -0,0 +1,238 @@
+import numpy as np
+from utils import PERIODS
+from metrics import get_play_actions, ACTION_TYPES
+
+# the structure of a play action: the match (position in event_arrays['match_ids']),
+# the range start:end of its events in the time-sorted order and the type (position in ACTION_TYPES)
+PLAY_ACTION_DTYPE = np.dtype([('match', np.int32), ('start', np.int32), ('end', np.int32), ('type', np.int8)])
+
+class EventView(object):
+    """
+    A read-only view of an event stored in the columnar arrays returned by
+    utils.get_event_arrays. It can be used as the dictionary of the event,
+    e.g. event['eventName'] or event['positions'][0]['x'], so that it can be
+    passed to the functions in metrics.py, but it only holds a reference to
+    the arrays and the position of the event.
+
+    Parameters
+    ----------
+    event_arrays : dict
+        the columnar events, as returned by utils.get_event_arrays
+
+    index : int
+        the position of the event in the arrays
+    """
+    __slots__ = ('event_arrays', 'index')
+
+    FIELDS = ['id', 'matchId', 'teamId', 'playerId', 'eventId', 'subEventId', 'eventName',
+              'subEventName', 'matchPeriod', 'eventSec', 'positions', 'tags']
+
+    def __init__(self, event_arrays, index):
+        self.event_arrays = event_arrays
+        self.index = index
+
+    def __getitem__(self, key):
+        arrays, i = self.event_arrays, self.index
+        if key == 'eventName':
+            return arrays['event_names'][arrays['event_name'][i]]
+        if key == 'subEventName':
+            return arrays['sub_event_names'][arrays['sub_event_name'][i]]
+        if key == 'matchPeriod':
+            return PERIODS[arrays['period'][i]]
+        if key == 'positions':
+            return [{'x': float(x), 'y': float(y)} for x, y in
+                    zip(arrays['position_x'][i, :arrays['n_positions'][i]], arrays['position_y'][i])]
+        if key == 'tags':
+            return [{'id': int(tag)} for tag in arrays['tag_ids'][arrays['tag_ptr'][i]:arrays['tag_ptr'][i + 1]]]
+        columns = {'id': 'id', 'matchId': 'match_id', 'teamId': 'team_id', 'playerId': 'player_id',
+                   'eventId': 'event_id', 'subEventId': 'sub_event_id', 'eventSec': 'event_sec'}
+        if key not in columns:
+            raise KeyError(key)
+        return arrays[columns[key]][i].item()
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self):
+        return list(self.FIELDS)
+
+    def __contains__(self, key):
+        return key in self.FIELDS
+
+    def __eq__(self, other):
+        if not isinstance(other, EventView):
+            return NotImplemented
+        return self.event_arrays is other.event_arrays and self.index == other.index
+
+    def __hash__(self):
+        return hash((id(self.event_arrays), self.index))
+
+    def to_dict(self):
+        return {key: self[key] for key in self.FIELDS}
+
+    def __repr__(self):
+        return 'EventView(%s)' %self.to_dict()
+
+class PlayAction(object):
+    """
+    A read-only view of a play action stored in PlayActions. For backward
+    compatibility it can be unpacked as the (action_type, events) tuples
+    returned by get_play_actions, the events being EventView objects.
+    """
+    __slots__ = ('play_actions', 'index')
+
+    def __init__(self, play_actions, index):
+        self.play_actions = play_actions
+        self.index = index
+
+    @property
+    def match_id(self):
+        return int(self.play_actions.event_arrays['match_ids'][self.play_actions.actions['match'][self.index]])
+
+    @property
+    def action_type(self):
+        return ACTION_TYPES[self.play_actions.actions['type'][self.index]]
+
+    @property
+    def event_indices(self):
+        """
+        The positions of the events of the action in the columnar arrays.
+        """
+        action = self.play_actions.actions[self.index]
+        return self.play_actions.order[action['start']:action['end']]
+
+    @property
+    def events(self):
+        return [EventView(self.play_actions.event_arrays, index) for index in self.event_indices]
+
+    def __len__(self):
+        return 2
+
+    def __getitem__(self, i):
+        return (self.action_type, self.events)[i]
+
+    def __iter__(self):
+        return iter((self.action_type, self.events))
+
+    def __repr__(self):
+        return 'PlayAction(%s, match=%s, %s events)' %(self.action_type, self.match_id, len(self.event_indices))
+
+class PlayActions(object):
+    """
+    The play actions of many matches, stored as a structured array of
+    PLAY_ACTION_DTYPE (13 bytes per action), with the start time of each
+    action (8 bytes) and the range of actions of each match for the time
+    window queries. The events of an action are
+    not copied: an action is a range of the time-sorted order of the events,
+    so the last event of an action lost by a team and the first event of the
+    next action are the same.
+
+    Parameters
+    ----------
+    event_arrays : dict
+        the columnar events, as returned by utils.get_event_arrays
+
+    order : numpy.ndarray
+        the positions of the events in the arrays, sorted by match and time
+        (event_arrays['order'])
+
+    actions : numpy.ndarray
+        the structured array of the actions, grouped by match and in time order
+        within each match
+    """
+    def __init__(self, event_arrays, order, actions):
+        self.event_arrays = event_arrays
+        self.order = order
+        self.actions = actions
+        self.match_id2match = {match_id: match for match, match_id in enumerate(event_arrays['match_ids'])}
+        # the actions of each match are actions[match_start[match]:match_end[match]]
+        self.match_start = np.zeros(len(event_arrays['match_ids']), dtype=np.int64)
+        self.match_end = np.zeros(len(event_arrays['match_ids']), dtype=np.int64)
+        matches, first, counts = np.unique(actions['match'], return_index=True, return_counts=True)
+        self.match_start[matches], self.match_end[matches] = first, first + counts
+        self.start_secs = event_arrays['sorted_sec'][actions['start']]
+
+    def __len__(self):
+        return len(self.actions)
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self.actions)
+        if not 0 <= i < len(self.actions):
+            raise IndexError(i)
+        return PlayAction(self, i)
+
+    def __iter__(self):
+        return (PlayAction(self, i) for i in range(len(self.actions)))
+
+    def nbytes(self):
+        """
+        The memory used by the actions, their start times and the ranges of the
+        matches (the order of the events is shared with event_arrays).
+        """
+        return self.actions.nbytes + self.start_secs.nbytes + self.match_start.nbytes + self.match_end.nbytes
+
+    def start_sec(self):
+        """
+        The time of the first event of each action, in seconds from the start of the match.
+        """
+        return self.start_secs
+
+    def in_window(self, match_id, start, end):
+        """
+        Get the actions of a match starting in the time window [start, end), in seconds 
+        from the start of the match, with a binary search on the start times of the
+        actions of the match.
+
+        Returns
+        -------
+        numpy.ndarray
+            the positions of the actions, in time order
+        """
+        first, last = self.match_start[self.match_id2match[match_id]], self.match_end[self.match_id2match[match_id]]
+        low, high = np.searchsorted(self.start_secs[first:last], [start, end], side='left')
+        return np.arange(first + low, first + high)
+
+def get_play_action_views(event_arrays, match_ids=None):
+    """
+    Split the events of the matches into play actions with get_play_actions
+    and store them as PlayActions.
+
+    Parameters
+    ----------
+    event_arrays : dict
+        the columnar events, as returned by utils.get_event_arrays
+
+    match_ids : list, optional
+        the identifiers of the matches. Default: all the matches
+
+    Returns
+    -------
+    PlayActions
+        the play actions of the matches
+    """
+    match_id2match = {match_id: match for match, match_id in enumerate(event_arrays['match_ids'])}
+    match_ids = list(match_id2match) if match_ids is None else match_ids
+    match_ptr, order = event_arrays['match_ptr'], event_arrays['order']
+    action_types = {action_type: code for code, action_type in enumerate(ACTION_TYPES)}
+
+    actions = []
+    for match_id in match_ids:
+        match = match_id2match[match_id]
+        first, last = match_ptr[match], match_ptr[match + 1]
+        # the position of each event of the match in the time-sorted order
+        position = np.empty(last - first, dtype=np.int64)
+        position[order[first:last] - first] = np.arange(first, last)
+
+        views = [EventView(event_arrays, index) for index in order[first:last]]
+        for action_type, action_events in get_play_actions({match_id: views}, match_id, is_sorted=True):
+            if len(action_events) == 0:
+                continue
+            actions.append((match, position[action_events[0].index - first],
+                            position[action_events[-1].index - first] + 1,
+                            action_types[action_type]))
+
+    return PlayActions(event_arrays, order, np.array(actions, dtype=PLAY_ACTION_DTYPE))
@@ -0,0 +1,155 @@
+import numpy as np
+from multiprocessing import Pool
+from scipy.ndimage import gaussian_filter
+from scipy.optimize import minimize
+from scipy.special import expit
+from utils import load_public_dataset, get_event_arrays, WEIGHT_GRID_FILE
+from metrics import SHOT
+from geometry import get_goal_geometry
+
+GOAL = 101
+
+def get_shots(event_arrays):
+    """
+    Extract all the shots (eventId SHOT) from the columnar events.
+
+    Parameters
+    ----------
+    event_arrays : dict
+        the columnar events, as returned by utils.get_event_arrays
+
+    Returns
+    -------
+    dict
+        the arrays 'x', 'y' (start position of the shot, towards the goal at x=100),
+        'goal' (whether the shot has the goal tag 101) and 'match_id'
+    """
+    is_goal = np.zeros(len(event_arrays['event_id']), dtype=bool)
+    tag_event = np.repeat(np.arange(len(is_goal)), np.diff(event_arrays['tag_ptr']))
+    is_goal[tag_event[event_arrays['tag_ids'] == GOAL]] = True
+
+    is_shot = (event_arrays['event_id'] == SHOT) & (event_arrays['n_positions'] > 0)
+    return {'x': event_arrays['position_x'][is_shot, 0], 'y': event_arrays['position_y'][is_shot, 0],
+            'goal': is_goal[is_shot], 'match_id': event_arrays['match_id'][is_shot]}
+
+def count_shots(shots, n_x=50, n_y=50):
+    """
+    Count the shots and the goals in each cell of a n_x x n_y grid over the pitch.
+
+    Returns
+    -------
+    tuple
+        the arrays of shape (n_x, n_y) of the shots and of the goals
+    """
+    i = np.clip((shots['x'] * n_x / 100.0).astype(np.int64), 0, n_x - 1)
+    j = np.clip((shots['y'] * n_y / 100.0).astype(np.int64), 0, n_y - 1)
+    cells = i * n_y + j
+    shot_counts = np.bincount(cells, minlength=n_x * n_y).reshape(n_x, n_y)
+    goal_counts = np.bincount(cells, weights=shots['goal'], minlength=n_x * n_y).reshape(n_x, n_y)
+    return shot_counts, goal_counts
+
+def fit_baseline(shot_counts, goal_counts):
+    """
+    Fit a logistic regression of the probability of scoring on the distance and
+    the angle to the goal (geometry.get_goal_geometry) of the centers of the cells.
+    Unlike the counts, the fit extends smoothly to the cells without shots, e.g.
+    far from the goal, where the probability tends to 0.
+
+    Parameters
+    ----------
+    shot_counts, goal_counts : numpy.ndarray
+        the shots and the goals in each cell, as returned by count_shots
+
+    Returns
+    -------
+    numpy.ndarray
+        the fitted scoring probability of each cell
+    """
+    n_x, n_y = shot_counts.shape
+    if shot_counts.sum() == 0:
+        return np.zeros((n_x, n_y))
+    x, y = np.meshgrid((np.arange(n_x) + 0.5) * 100.0 / n_x, (np.arange(n_y) + 0.5) * 100.0 / n_y, indexing='ij')
+    distance, angle = get_goal_geometry(x.ravel(), y.ravel())
+    features = np.column_stack([np.ones(len(distance)), distance / 10.0, angle])
+    shots, goals = shot_counts.ravel().astype(np.float64), goal_counts.ravel().astype(np.float64)
+
+    # the negative log-likelihood of the goals (binomial in each cell) and its gradient
+    def loss(beta):
+        z = features.dot(beta)
+        return np.sum(shots * np.logaddexp(0, z) - goals * z)
+
+    def gradient(beta):
+        return features.T.dot(shots * expit(features.dot(beta)) - goals)
+
+    beta = minimize(loss, np.zeros(features.shape[1]), jac=gradient, method='BFGS').x
+    return expit(features.dot(beta)).reshape(n_x, n_y)
+
+def fit_scoring_grid(shot_counts, goal_counts, sigma=1.5, prior_strength=5.0):
+    """
+    Estimate the probability of scoring from each cell of the grid. The counts are
+    smoothed with a Gaussian filter, then the probability is shrunk towards the
+    distance and angle baseline of fit_baseline, so that cells with few shots
+    get a sensible value for their position.
+
+    Parameters
+    ----------
+    shot_counts, goal_counts : numpy.ndarray
+        the shots and the goals in each cell, as returned by count_shots
+
+    sigma : float, optional
+        the standard deviation (in cells) of the Gaussian filter. Default: 1.5
+
+    prior_strength : float, optional
+        the number of pseudo-shots at the baseline probability added to each cell.
+        Default: 5.0
+
+    Returns
+    -------
+    numpy.ndarray
+        the scoring probability of each cell
+    """
+    baseline = fit_baseline(shot_counts, goal_counts)
+    smoothed_shots = gaussian_filter(shot_counts.astype(np.float64), sigma, mode='nearest')
+    smoothed_goals = gaussian_filter(goal_counts.astype(np.float64), sigma, mode='nearest')
+    return (smoothed_goals + prior_strength * baseline) / (smoothed_shots + prior_strength)
+
+def save_weight_grid(grid, file_name=WEIGHT_GRID_FILE):
+    """
+    Save a grid of scoring probabilities in the format read by utils.load_weight_grid.
+    """
+    n_x, n_y = grid.shape
+    np.savez(file_name, grid=grid.astype(np.float32),
+             x_edges=np.linspace(0, 100, n_x + 1), y_edges=np.linspace(0, 100, n_y + 1))
+
+def _count_tournament_shots(job):
+    tournament, n_x, n_y = job
+    match_id2match, match_id2events = load_public_dataset(tournament=tournament)[:2]
+    return tournament, count_shots(get_shots(get_event_arrays(match_id2events)), n_x=n_x, n_y=n_y)
+
+def fit_competitions(tournaments, n_x=50, n_y=50, sigma=1.5, prior_strength=5.0, workers=None):
+    """
+    Fit a scoring grid for each competition and one for all of them together.
+    The competitions are loaded and their shots counted in parallel.
+
+    Parameters
+    ----------
+    tournaments : list
+        the competitions, as in utils.TOURNAMENTS
+
+    workers : int, optional
+        the number of processes. Default: the number of CPUs
+
+    Returns
+    -------
+    dict
+        a dictionary of competitions (and 'all') to scoring grids
+    """
+    with Pool(workers) as pool:
+        tournament2counts = dict(pool.map(_count_tournament_shots, [(tournament, n_x, n_y)
+                                                                    for tournament in tournaments]))
+    tournament2grid = {tournament: fit_scoring_grid(shot_counts, goal_counts, sigma, prior_strength)
+                       for tournament, (shot_counts, goal_counts) in tournament2counts.items()}
+    tournament2grid['all'] = fit_scoring_grid(sum(counts[0] for counts in tournament2counts.values()),
+                                              sum(counts[1] for counts in tournament2counts.values()),
+                                              sigma, prior_strength)
+    return tournament2grid
@@ -0,0 +1,114 @@
+import numpy as np
+from utils import get_weights, get_match_index
+
+# size of the pitch in metres, as drawn by plot_utils.draw_pitch
+PITCH_LENGTH = 104.0
+PITCH_WIDTH = 68.0
+GOAL_WIDTH = 7.32
+
+def get_reference_teams(event_arrays):
+    """
+    Get, for each match, the team of the first event of the match in time order
+    (event_arrays['order']). It is the default team whose attacking direction is
+    used for all the events of the match.
+
+    Returns
+    -------
+    numpy.ndarray
+        the identifier of the reference team of each match (-1 if the match has no events)
+    """
+    match_ptr = event_arrays['match_ptr']
+    reference_teams = np.full(len(event_arrays['match_ids']), -1, dtype=np.int64)
+    has_events = match_ptr[1:] > match_ptr[:-1]
+    reference_teams[has_events] = event_arrays['team_id'][event_arrays['order'][match_ptr[:-1][has_events]]]
+    return reference_teams
+
+def get_goal_geometry(x, y):
+    """
+    Get the distance and the angle of positions from the goal at (100, 50),
+    the one attacked by the team of the event.
+
+    Parameters
+    ----------
+    x, y : numpy.ndarray
+        the Wyscout coordinates (percentage of the pitch)
+
+    Returns
+    -------
+    tuple
+        the distance (metres) from the center of the goal and the angle (radians)
+        under which the goal is seen
+    """
+    goal_x, goal_y = (100 - x) * PITCH_LENGTH / 100, (50 - y) * PITCH_WIDTH / 100
+    angle = np.arctan2(GOAL_WIDTH * goal_x, goal_x ** 2 + goal_y ** 2 - (GOAL_WIDTH / 2) ** 2)
+    return np.hypot(goal_x, goal_y), np.where(angle < 0, angle + np.pi, angle)
+
+def get_event_geometry(event_arrays, metres=False, canonical=False, reference_teams=None):
+    """
+    Compute, once for all the events, the coordinates of the start and end
+    positions as float32 arrays, together with the columns derived from them.
+
+    Wyscout positions are in percentage of the pitch and relative to the team
+    that generates the event, which always attacks towards x=100. With
+    canonical=True, the events of the other team of the match are flipped,
+    so that all the events of a match are in the attacking direction of the
+    reference team. The zone weights and the goal columns are always computed
+    in the original direction of each event, i.e. towards the goal attacked
+    by the team of the event.
+
+    Parameters
+    ----------
+    event_arrays : dict
+        the columnar events, as returned by utils.get_event_arrays
+
+    metres : bool, optional
+        whether to scale the coordinates to a pitch of PITCH_LENGTH x PITCH_WIDTH
+        metres, the one drawn by plot_utils.draw_pitch. Default: False
+
+    canonical : bool, optional
+        whether to express all the events of a match in the direction of the
+        reference team. Default: False
+
+    reference_teams : numpy.ndarray, optional
+        the reference team of each match, aligned with event_arrays['match_ids'].
+        Default: get_reference_teams(event_arrays)
+
+    Returns
+    -------
+    dict
+        a dictionary of float32 arrays with one entry per event:
+        - 'x_start', 'y_start', 'x_end', 'y_end': the coordinates (NaN if missing;
+          the end is the start for events with a single position)
+        - 'dx', 'dy', 'distance': the displacement from start to end
+        - 'distance_to_goal': the distance of the start from the center of the goal,
+          in metres with metres=True, in the Wyscout coordinates otherwise
+        - 'angle_to_goal': the angle (radians) under which the goal is seen from the start
+        - 'zone_weight': utils.get_weights of the start
+    """
+    position_x, position_y = event_arrays['position_x'], event_arrays['position_y']
+    has_end = event_arrays['n_positions'] > 1
+    x_start, y_start = position_x[:, 0], position_y[:, 0]
+    x_end = np.where(has_end, position_x[:, 1], x_start)
+    y_end = np.where(has_end, position_y[:, 1], y_start)
+
+    geometry = {'zone_weight': get_weights(np.nan_to_num(x_start, nan=-1).astype(int),
+                                           np.nan_to_num(y_start, nan=-1).astype(int))}
+
+    distance_to_goal, geometry['angle_to_goal'] = get_goal_geometry(x_start, y_start)
+    geometry['distance_to_goal'] = distance_to_goal if metres else np.hypot(100 - x_start, 50 - y_start)
+
+    if canonical:
+        if reference_teams is None:
+            reference_teams = get_reference_teams(event_arrays)
+        flip = event_arrays['team_id'] != reference_teams[get_match_index(event_arrays)]
+        x_start, x_end = np.where(flip, 100 - x_start, x_start), np.where(flip, 100 - x_end, x_end)
+        y_start, y_end = np.where(flip, 100 - y_start, y_start), np.where(flip, 100 - y_end, y_end)
+
+    if metres:
+        x_start, x_end = x_start * PITCH_LENGTH / 100, x_end * PITCH_LENGTH / 100
+        y_start, y_end = y_start * PITCH_WIDTH / 100, y_end * PITCH_WIDTH / 100
+
+    geometry.update({'x_start': x_start, 'y_start': y_start, 'x_end': x_end, 'y_end': y_end,
+                     'dx': x_end - x_start, 'dy': y_end - y_start})
+    geometry['distance'] = np.hypot(geometry['dx'], geometry['dy'])
+    return {name: np.asarray(column, dtype=np.float32) for name, column in geometry.items()}
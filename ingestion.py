@@ -0,0 +1,323 @@
+import asyncio
+import json
+import time
+import numpy as np
+from collections import Counter, defaultdict
+from utils import get_weight, PERIODS
+from metrics import (START_OF_GAME_EVENT, is_interruption, is_penalty, is_shot, is_save_attempt,
+                     is_reflexes, is_ball_lost, is_duel)
+
+# the fields of an event used by metrics.py, with their types
+EVENT_SCHEMA = {
+    'id': int,
+    'matchId': int,
+    'teamId': int,
+    'playerId': int,
+    'eventName': (int, str),
+    'subEventName': (int, str),
+    'eventSec': (int, float),
+    'matchPeriod': str,
+    'positions': list,
+    'tags': list
+}
+
+def validate_event(event):
+    """
+    Verify that an event has the fields and types expected by metrics.py.
+
+    Parameters
+    ----------
+    event: dict
+        a dictionary describing the event
+
+    Raises
+    ------
+    ValueError
+        if the event is not valid
+    """
+    if not isinstance(event, dict):
+        raise ValueError('the event is not a dictionary')
+    for field, field_type in EVENT_SCHEMA.items():
+        if field not in event:
+            raise ValueError('missing field %s' %field)
+        if not isinstance(event[field], field_type) or isinstance(event[field], bool):
+            raise ValueError('wrong type for field %s: %s' %(field, type(event[field]).__name__))
+    if event['matchPeriod'] not in PERIODS:
+        raise ValueError('unknown matchPeriod %s' %event['matchPeriod'])
+    for position in event['positions']:
+        if not isinstance(position, dict) or \
+                any(not isinstance(position.get(axis), (int, float)) or isinstance(position.get(axis), bool)
+                    for axis in ['x', 'y']):
+            raise ValueError('wrong position %s' %position)
+    for tag in event['tags']:
+        if not isinstance(tag, dict) or not isinstance(tag.get('id'), int) or isinstance(tag['id'], bool):
+            raise ValueError('wrong tag %s' %tag)
+
+class LatencyHistogram(object):
+    """
+    Histogram of latencies (in seconds) with logarithmic buckets, from
+    min_latency to max_latency.
+    """
+    def __init__(self, min_latency=1e-6, max_latency=10.0, n_buckets=64):
+        self.edges = np.logspace(np.log10(min_latency), np.log10(max_latency), n_buckets + 1)
+        self.counts = np.zeros(n_buckets + 2, dtype=np.int64)
+
+    def add(self, latency):
+        self.counts[np.searchsorted(self.edges, latency, side='right')] += 1
+
+    def count(self):
+        return int(self.counts.sum())
+
+    def percentile(self, q):
+        """
+        Get the upper edge of the bucket containing the q-th percentile (0-100).
+        """
+        if self.count() == 0:
+            return float('nan')
+        bucket = np.searchsorted(np.cumsum(self.counts), q / 100.0 * self.count())
+        return float(self.edges[min(bucket, len(self.edges) - 1)])
+
+    def summary(self):
+        return {'count': self.count(),
+                'p50': self.percentile(50), 'p90': self.percentile(90), 'p99': self.percentile(99)}
+
+class MatchState(object):
+    """
+    Incremental version of get_play_actions and get_invasion_index: the events
+    of a match are processed one at a time, in order of arrival, and the play
+    actions are closed as soon as possible. Shots and penalties are closed
+    when the next event arrives, since it may belong to the same action.
+
+    Parameters
+    ----------
+    match_id: int
+        the identifier of the match
+    """
+    def __init__(self, match_id):
+        self.match_id = match_id
+        self.n_events = 0
+        self.action_counts = Counter()
+        self.team2invasion_index = defaultdict(list)
+        self.current_action = []
+        self.current_half = '1H'
+        self.previous_event = START_OF_GAME_EVENT
+        self.pending = None
+        self.first_half_end = 0.0
+
+    def _close_action(self, action_type, next_action):
+        action_events = self.current_action
+        self.action_counts[action_type] += 1
+        self.current_action = next_action
+
+        if len(set([event['matchPeriod'] for event in action_events])) > 1:
+            return
+        weights = [get_weight((int(event['positions'][0]['x']), int(event['positions'][0]['y'])))
+                   for event in action_events if event['positions']]
+        if weights:
+            offset = self.first_half_end if action_events[0]['matchPeriod'] == '2H' else 0
+            self.team2invasion_index[action_events[0]['teamId']].append(
+                (action_events[0]['eventSec'] + offset, max(weights)))
+
+    def update(self, event):
+        """
+        Process the next event of the match.
+        """
+        self.n_events += 1
+        if event['matchPeriod'] == '1H':
+            self.first_half_end = max(self.first_half_end, event['eventSec'])
+
+        # a shot or a penalty waiting for the next event
+        if self.pending is not None:
+            action_type, self.pending = self.pending, None
+            if is_save_attempt(event) or is_reflexes(event) or \
+                    (action_type == 'shot' and is_interruption(event, self.current_half)):
+                self.current_action.append(event)
+                self._close_action(action_type, [])
+                return
+            if action_type == 'shot':
+                self._close_action('shot', [])
+
+        if is_interruption(event, self.current_half):
+            self.current_action.append(event)
+            self._close_action('interruption', [])
+        elif is_penalty(event):
+            self.current_action.append(event)
+            self.pending = 'penalty'
+        elif is_shot(event):
+            self.current_action.append(event)
+            self.pending = 'shot'
+        elif is_ball_lost(event, self.previous_event):
+            self.current_action.append(event)
+            self._close_action('ball lost', [event])
+        else:
+            self.current_action.append(event)
+
+        self.current_half = event['matchPeriod']
+        if not is_duel(event):
+            self.previous_event = event
+
+class IngestionService(object):
+    """
+    Consume a stream of newline-delimited JSON events, validate them and route
+    them to one bounded queue per match. Each queue is consumed by a task that
+    updates the MatchState of the match. When a queue is full, reading from
+    the source is suspended until the queue has room again (backpressure).
+    The latency from the reception of an event to the update of its
+    match state is recorded in a LatencyHistogram. An event that fails
+    to update its match state (e.g. an unknown tag) is counted in
+    n_failed and skipped, so that the consumer of the match keeps running.
+
+    Parameters
+    ----------
+    max_queue_size: int, optional
+        the maximum number of events waiting in the queue of a match. Default: 1000
+    """
+    def __init__(self, max_queue_size=1000):
+        self.max_queue_size = max_queue_size
+        self.match_id2queue = {}
+        self.match_id2state = {}
+        self.workers = []
+        self.latency = LatencyHistogram()
+        self.n_invalid = 0
+        self.n_failed = 0
+
+    async def _consume(self, queue, state):
+        while True:
+            received, event = await queue.get()
+            try:
+                state.update(event)
+                self.latency.add(time.perf_counter() - received)
+            except Exception:
+                self.n_failed += 1
+            finally:
+                queue.task_done()
+
+    def _get_queue(self, match_id):
+        if match_id not in self.match_id2queue:
+            queue = asyncio.Queue(maxsize=self.max_queue_size)
+            state = MatchState(match_id)
+            self.match_id2queue[match_id] = queue
+            self.match_id2state[match_id] = state
+            self.workers.append(asyncio.ensure_future(self._consume(queue, state)))
+        return self.match_id2queue[match_id]
+
+    async def put_line(self, line):
+        """
+        Parse, validate and route a line of JSON. Invalid lines are counted and discarded.
+        """
+        received = time.perf_counter()
+        try:
+            event = json.loads(line)
+            validate_event(event)
+        except ValueError:
+            self.n_invalid += 1
+            return
+        await self._get_queue(event['matchId']).put((received, event))
+
+    async def ingest(self, lines):
+        """
+        Ingest all the lines of an asynchronous iterator (e.g. read_socket or tail_file).
+        """
+        async for line in lines:
+            if line.strip():
+                await self.put_line(line)
+
+    async def close(self):
+        """
+        Wait for all the queued events to be processed and stop the consumers.
+        """
+        for queue in self.match_id2queue.values():
+            await queue.join()
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers = []
+
+async def read_socket(host, port):
+    """
+    Read the lines sent by a producer on a TCP socket, until the connection is closed.
+    """
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            yield line.decode('utf-8')
+    finally:
+        writer.close()
+
+async def tail_file(file_name, poll_interval=0.1, stop_line=None):
+    """
+    Read the lines of a file as they are appended to it, as in tail -f.
+    Stop when the line stop_line is read, if given.
+    """
+    with open(file_name) as f:
+        buffer = ''
+        while True:
+            chunk = f.readline()
+            if not chunk:
+                await asyncio.sleep(poll_interval)
+                continue
+            buffer += chunk
+            if not buffer.endswith('\n'):
+                continue # wait for the rest of the line
+            line, buffer = buffer, ''
+            if stop_line is not None and line.strip() == stop_line:
+                break
+            yield line
+
+async def serve_events(events, host='127.0.0.1', port=0, events_per_second=None):
+    """
+    Local stand-in for a live feed: a TCP server sending the input events as
+    newline-delimited JSON to every client that connects, then closing the
+    connection.
+
+    Parameters
+    ----------
+    events: list
+        the events to send
+
+    events_per_second: float, optional
+        the rate of the events. Default: as fast as possible
+
+    Returns
+    -------
+    asyncio.Server
+        the server; the port is in server.sockets[0].getsockname()[1]
+    """
+    async def send(reader, writer):
+        for event in events:
+            writer.write((json.dumps(event) + '\n').encode('utf-8'))
+            await writer.drain()
+            if events_per_second:
+                await asyncio.sleep(1.0 / events_per_second)
+        writer.close()
+    return await asyncio.start_server(send, host, port)
+
+async def run_ingestion(lines, max_queue_size=1000):
+    """
+    Ingest all the lines and return the service, with the final state of each match.
+    """
+    service = IngestionService(max_queue_size=max_queue_size)
+    await service.ingest(lines)
+    await service.close()
+    return service
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Ingest a live feed of events')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int)
+    parser.add_argument('--file', help='a file of newline-delimited events to follow')
+    parser.add_argument('--max-queue-size', type=int, default=1000)
+    args = parser.parse_args()
+
+    lines = tail_file(args.file) if args.file else read_socket(args.host, args.port)
+    service = asyncio.get_event_loop().run_until_complete(run_ingestion(lines, args.max_queue_size))
+    for match_id, state in service.match_id2state.items():
+        print(match_id, state.n_events, dict(state.action_counts))
+    print('invalid events:', service.n_invalid)
+    print('failed events:', service.n_failed)
+    print('latency:', service.latency.summary())
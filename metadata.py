@@ -0,0 +1,258 @@
+import sys
+import numpy as np
+import pandas as pd
+
+def encode(values, dtype=np.int16):
+    """
+    Encode a list of strings as integer codes and a list of interned categories.
+
+    Returns
+    -------
+    tuple
+        the array of codes and the list of categories, i.e. values[i] == categories[codes[i]]
+    """
+    value2code, codes = {}, []
+    for value in values:
+        codes.append(value2code.setdefault(value, len(value2code)))
+    return np.array(codes, dtype=dtype), [sys.intern(value) if isinstance(value, str) else value
+                                          for value in value2code]
+
+def to_int(value, default=0):
+    """
+    Convert a value of the dataset to int, e.g. the goals in the formations, which 
+    can be numbers, strings or "null".
+    """
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return default
+
+def intern_strings(values):
+    """
+    Store a list of (mostly distinct) strings as an object array of interned strings.
+    """
+    return np.array([sys.intern(value) for value in values], dtype=object)
+
+class Table(object):
+    """
+    A table of metadata (players, teams or matches) stored by columns: NumPy arrays
+    for the numbers, integer codes for the repeated strings (roles, feet, nations, ...)
+    and interned strings for the names. The rows are sorted by identifier and
+    looked up with a binary search; unlike a defaultdict, looking up a missing
+    identifier does not insert anything.
+
+    Parameters
+    ----------
+    ids : numpy.ndarray
+        the identifiers of the rows
+
+    columns : dict
+        the columns, aligned with ids
+
+    categories : dict
+        for the encoded columns, the list of categories
+    """
+    def __init__(self, ids, columns, categories=None):
+        order = np.argsort(ids, kind='stable')
+        self.ids = np.asarray(ids, dtype=np.int64)[order]
+        self.columns = {name: np.asarray(column)[order] for name, column in columns.items()}
+        self.categories = categories or {}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def index(self, row_id):
+        """
+        Get the position of a row, or -1 if there is no row with that identifier.
+        """
+        position = np.searchsorted(self.ids, row_id)
+        if position < len(self.ids) and self.ids[position] == row_id:
+            return int(position)
+        return -1
+
+    def __contains__(self, row_id):
+        return self.index(row_id) >= 0
+
+    def __getitem__(self, row_id):
+        position = self.index(row_id)
+        if position < 0:
+            raise KeyError(row_id)
+        row = {'wyId': int(self.ids[position])}
+        for name, column in self.columns.items():
+            value = column[position]
+            if name in self.categories:
+                value = self.categories[name][value]
+            row[name] = value.item() if isinstance(value, np.generic) else value
+        return row
+
+    def get(self, row_id, default=None):
+        try:
+            return self[row_id]
+        except KeyError:
+            return default
+
+    def column(self, name, row_ids):
+        """
+        Get the values of a column for many rows at once.
+
+        Raises
+        ------
+        KeyError
+            if some identifiers are not in the table
+        """
+        row_ids = np.asarray(row_ids, dtype=np.int64)
+        positions = np.minimum(np.searchsorted(self.ids, row_ids), max(len(self.ids) - 1, 0))
+        is_missing = self.ids[positions] != row_ids if len(self.ids) else np.ones(len(row_ids), dtype=bool)
+        if is_missing.any():
+            raise KeyError(int(row_ids[is_missing][0]))
+        values = self.columns[name][positions]
+        if name in self.categories:
+            values = np.array(self.categories[name], dtype=object)[values]
+        return values
+
+    def nbytes(self):
+        """
+        Estimate the memory used by the table: the arrays, the distinct strings
+        and the categories.
+        """
+        total = self.ids.nbytes
+        for column in self.columns.values():
+            total += column.nbytes
+            if column.dtype == object:
+                total += sum(sys.getsizeof(value) for value in set(column.tolist()))
+        for categories in self.categories.values():
+            total += sum(sys.getsizeof(category) for category in categories)
+        return total
+
+class MetadataStore(object):
+    """
+    Compact version of the dictionaries of players, teams and matches returned
+    by utils.load_public_dataset. The formations and substitutions of the
+    matches, nested in the teamsData of each match, are stored as flat arrays
+    with one row per player (formations) or per substitution.
+
+    Parameters
+    ----------
+    player_id2player, team_id2team, match_id2match : dict
+        the dictionaries of players, teams and matches
+    """
+    def __init__(self, player_id2player, team_id2team, match_id2match):
+        self.players = self._build_players(player_id2player)
+        self.teams = self._build_teams(team_id2team)
+        self.matches = self._build_matches(match_id2match)
+        self._build_formations(match_id2match)
+
+    def _build_players(self, player_id2player):
+        players = list(player_id2player.values())
+        categories, columns = {}, {}
+        for name, get in [('role', lambda player: player['role']['name']),
+                          ('foot', lambda player: player['foot']),
+                          ('nation', lambda player: player['passportArea']['name']),
+                          ('birthArea', lambda player: player['birthArea']['name'])]:
+            columns[name], categories[name] = encode([get(player) for player in players])
+        for name in ['shortName', 'firstName', 'lastName', 'birthDate']:
+            columns[name] = intern_strings([player[name] for player in players])
+        for name in ['height', 'weight']:
+            columns[name] = np.array([player[name] for player in players], dtype=np.int16)
+        for name in ['currentTeamId', 'currentNationalTeamId']:
+            columns[name] = np.array([to_int(player[name], -1) for player in players], dtype=np.int64)
+        return Table([player['wyId'] for player in players], columns, categories)
+
+    def _build_teams(self, team_id2team):
+        teams = list(team_id2team.values())
+        categories, columns = {}, {}
+        for name, get in [('area', lambda team: team['area']['name']),
+                          ('type', lambda team: team['type']),
+                          ('city', lambda team: team['city'])]:
+            columns[name], categories[name] = encode([get(team) for team in teams])
+        for name in ['name', 'officialName']:
+            columns[name] = intern_strings([team[name] for team in teams])
+        return Table([team['wyId'] for team in teams], columns, categories)
+
+    def _build_matches(self, match_id2match):
+        matches = list(match_id2match.values())
+        categories, columns = {}, {}
+        for name in ['status', 'venue', 'duration']:
+            columns[name], categories[name] = encode([match[name] for match in matches])
+        for name in ['label', 'date', 'dateutc']:
+            columns[name] = intern_strings([match[name] for match in matches])
+        for name, dtype in [('competitionId', np.int64), ('seasonId', np.int64), ('roundId', np.int64),
+                            ('gameweek', np.int16), ('winner', np.int64)]:
+            columns[name] = np.array([match[name] for match in matches], dtype=dtype)
+        return Table([match['wyId'] for match in matches], columns, categories)
+
+    def _build_formations(self, match_id2match):
+        formations, substitutions = [], []
+        for match_id, match in match_id2match.items():
+            for team_id, team_data in match['teamsData'].items():
+                formation = team_data.get('formation') or {}
+                for in_lineup, players in [(1, formation.get('lineup') or []), (0, formation.get('bench') or [])]:
+                    for player in players:
+                        formations.append((match_id, int(team_id), player['playerId'], in_lineup,
+                                           to_int(player['goals']), to_int(player['ownGoals']),
+                                           to_int(player['yellowCards']), to_int(player['redCards'])))
+                for substitution in formation.get('substitutions') or []:
+                    substitutions.append((match_id, int(team_id), substitution['playerIn'],
+                                          substitution['playerOut'], substitution['minute']))
+        self.formations = np.array(formations, dtype=[
+            ('matchId', np.int64), ('teamId', np.int64), ('playerId', np.int64), ('lineup', np.int8),
+            ('goals', np.int8), ('ownGoals', np.int8), ('yellowCards', np.int8), ('redCards', np.int8)])
+        self.substitutions = np.array(substitutions, dtype=[
+            ('matchId', np.int64), ('teamId', np.int64), ('playerIn', np.int64), ('playerOut', np.int64),
+            ('minute', np.int16)])
+
+    def get_match_players(self, match_id):
+        """
+        Get the players of a match: the lineup, the bench and the substitutes,
+        as in utils.is_in_match.
+        """
+        formations = self.formations[self.formations['matchId'] == match_id]
+        substitutions = self.substitutions[self.substitutions['matchId'] == match_id]
+        return np.union1d(formations['playerId'], substitutions['playerIn'])
+
+    def nbytes(self):
+        return {'players': self.players.nbytes(), 'teams': self.teams.nbytes(),
+                'matches': self.matches.nbytes(),
+                'formations': self.formations.nbytes + self.substitutions.nbytes}
+
+def get_deep_size(obj, seen=None):
+    """
+    Estimate the memory used by a Python object and all the objects it contains.
+    """
+    seen = set() if seen is None else seen
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(get_deep_size(key, seen) + get_deep_size(value, seen) for key, value in obj.items())
+    elif isinstance(obj, (list, tuple, set)):
+        size += sum(get_deep_size(value, seen) for value in obj)
+    return size
+
+def get_memory_report(store, player_id2player, team_id2team, match_id2match, match_id2events=None,
+                      event_arrays=None):
+    """
+    Compare the memory used by the dictionaries of metadata and by the MetadataStore
+    and, if given, by the dictionaries of events and by their columnar version
+    (utils.get_event_arrays, where matchPeriod and the event names are integer codes).
+
+    Returns
+    -------
+    pandas.DataFrame
+        the memory (MB) of each kind of data in the two representations
+    """
+    store_sizes = store.nbytes()
+    dict_sizes = {'players': get_deep_size(player_id2player), 'teams': get_deep_size(team_id2team),
+                  'matches': get_deep_size({match_id: {key: value for key, value in match.items()
+                                                       if key != 'teamsData'}
+                                            for match_id, match in match_id2match.items()}),
+                  'formations': get_deep_size([match['teamsData'] for match in match_id2match.values()])}
+    if match_id2events is not None and event_arrays is not None:
+        dict_sizes['events'] = get_deep_size(match_id2events)
+        store_sizes['events'] = sum(array.nbytes for array in event_arrays.values())
+    report = pd.DataFrame({'dict (MB)': pd.Series(dict_sizes) / 2 ** 20,
+                           'store (MB)': pd.Series(store_sizes) / 2 ** 20})
+    report.loc['total'] = report.sum()
+    report['ratio'] = report['dict (MB)'] / report['store (MB)']
+    return report
@@ -1,7 +1,10 @@
 import pandas as pd
 from collections import defaultdict
-from utils import get_weight
+from utils import get_weight, get_datadriven_weight, get_period_offsets, PERIODS
 import numpy as np
+import json
+from scipy import sparse
+import networkx as nx
 
 data_folder = 'data/'
 tags_names_df = pd.read_csv(data_folder + 'tags2name.csv', delimiter=';')
@@ -20,6 +23,8 @@ PASS = 8
 PENALTY = 35
 ACCURATE_PASS = 1801
 
+ACTION_TYPES = ['interruption', 'penalty', 'shot', 'ball lost']
+
 END_OF_GAME_EVENT = {
     u'eventName': -1,
  u'eventSec': 7200,
@@ -153,7 +158,7 @@ def pre_process(events):
     return filtered_events
 
 
-def get_play_actions(match_id2events, match_id, verbose=False):
+def get_play_actions(match_id2events, match_id, verbose=False, is_sorted=False):
     """
     Given a list of events occuring during a game, it splits the events
     into play actions using the following principle:
@@ -166,9 +171,11 @@ def get_play_actions(match_id2events, match_id, verbose=False):
     """
     try:
         events_match = match_id2events[match_id]
-        half_offset = {'2H' : max([x['eventSec'] for x in events_match if x['matchPeriod']=='1H']),
-                      '1H':0}
-        events_match = sorted(events_match, key = lambda x: x['eventSec'] + half_offset[x['matchPeriod']])
+        if is_sorted:
+            events_match = list(events_match)
+        else:
+            half_offset = get_period_offsets(events_match)
+            events_match = sorted(events_match, key = lambda x: x['eventSec'] + half_offset[x['matchPeriod']])
         ## add a fake event representing the start and end of the game
         events_match.insert(0, START_OF_GAME_EVENT)
         events_match.append(END_OF_GAME_EVENT)
@@ -245,7 +252,7 @@ def get_play_actions(match_id2events, match_id, verbose=False):
     except TypeError:
         return []
     
-def get_invasion_index(tournaments, events, match_id, lst=False):
+def get_invasion_index(tournaments, events, match_id, lst=False, datadriven=False):
     """
     Compute the invasion index for the input match
     
@@ -260,14 +267,17 @@ def get_invasion_index(tournaments, events, match_id, lst=False):
     match_id: int
         the match_id of the match for which we want the invasion index
         
+    datadriven: bool, optional
+        whether to weight the positions with the scoring probabilities fitted on 
+        the shots (utils.get_datadriven_weight) instead of get_weight. Default: False
+        
     Returns
     -------
     float
         the invasion index of the two teams, the list of invasion acceleration 
         for each possesion phase of each team
     """
-    # get the actions in the match
-    actions = get_play_actions(tournaments, events, match_id)
+    weight = get_datadriven_weight if datadriven else get_weight
     team2invasion_index = defaultdict(list)
     team2invasion_speed = defaultdict(list)
     
@@ -277,9 +287,10 @@ def get_invasion_index(tournaments, events, match_id, lst=False):
             if event['matchId'] == match_id:
                 events_match.append(event)
                 
-    half_offset = {'2H': max([x['eventSec'] for x in events_match if x['matchPeriod']=='1H']),
-                      '1H':0}
+    # sort the events once and get the actions in the match
+    half_offset = get_period_offsets(events_match)
     events_match = sorted(events_match, key = lambda x: x['eventSec'] + half_offset[x['matchPeriod']])
+    actions = get_play_actions({match_id: events_match}, match_id, is_sorted=True)
     off = half_offset['2H']
     times_all = []
     # for each action
@@ -295,8 +306,7 @@ def get_invasion_index(tournaments, events, match_id, lst=False):
                 x, y, s = int(event['positions'][0]['x']), int(event['positions'][0]['y']), event['eventSec']
             except:
                 continue #skip to next event in case of missing position data
-            all_weights.append(get_weight((x, y)))
-            #all_weights.append(get_datadriven_weight((x, y)))
+            all_weights.append(weight((x, y)))
             times.append(s)
 
         times_maxinv = sorted(times,key=lambda x:all_weights[times.index(x)],reverse=True)[0]
@@ -312,3 +322,206 @@ def get_invasion_index(tournaments, events, match_id, lst=False):
     
     return team2invasion_index, team2invasion_speed
 
+
+def get_in_match_timelines(event_arrays, max_minute=60):
+    """
+    Count, in a single pass over the whole corpus, the number of events of each 
+    type and the number of events with each tag in every minute of every period.
+    The timeline of a single tag or type of event is then a slice of the result,
+    e.g. timelines['tags'][list(timelines['tag_ids']).index(101)] for the goals.
+    
+    Parameters
+    ----------
+    event_arrays : dict
+        the columnar events, as returned by utils.get_event_arrays
+        
+    max_minute : int, optional
+        the number of minute bins per period. Events after the last minute 
+        (e.g. added time) are counted in the last bin. Default: 60
+        
+    Returns
+    -------
+    dict
+        - 'tag_ids': the sorted tag identifiers
+        - 'tags': array of shape (tags, periods, minutes) with the counts per tag
+        - 'event_names': the names of the event types
+        - 'events': array of shape (event types, periods, minutes) with the counts 
+          per type of event
+        The periods are those in utils.PERIODS.
+    """
+    n_periods = len(PERIODS)
+    minutes = np.minimum((event_arrays['event_sec'] // 60).astype(np.int64), max_minute - 1)
+    period_minute = event_arrays['period'].astype(np.int64) * max_minute + minutes
+    
+    # one (tag, period, minute) key per tag of every event
+    tag_ids, tag_codes = np.unique(event_arrays['tag_ids'], return_inverse=True)
+    tag_event = np.repeat(np.arange(len(minutes)), np.diff(event_arrays['tag_ptr']))
+    keys = tag_codes.astype(np.int64) * (n_periods * max_minute) + period_minute[tag_event]
+    tags = np.bincount(keys, minlength=len(tag_ids) * n_periods * max_minute)
+    
+    event_names = event_arrays['event_names']
+    keys = event_arrays['event_name'].astype(np.int64) * (n_periods * max_minute) + period_minute
+    events = np.bincount(keys, minlength=len(event_names) * n_periods * max_minute)
+    
+    return {
+        'tag_ids': tag_ids,
+        'tags': tags.reshape(len(tag_ids), n_periods, max_minute),
+        'event_names': event_names,
+        'events': events.reshape(len(event_names), n_periods, max_minute)
+    }
+
+def get_feature_matrix(event_arrays):
+    """
+    Count, for each player in each match, the events of each PlayeRank quality 
+    feature, directly from the columnar events. The features are named as in 
+    feature_weights.json: eventName-subEventName for the event (just eventName 
+    for fouls) and eventName-subEventName-tag for each of its tags, with the 
+    description of the tag in lower case (e.g. "Duel-Air duel-accurate", 
+    "Foul-yellow card"). Events without a player (playerId 0) are ignored.
+    
+    Parameters
+    ----------
+    event_arrays : dict
+        the columnar events, as returned by utils.get_event_arrays
+        
+    Returns
+    -------
+    tuple
+        the sparse matrix (scipy.sparse.csr_matrix) of counts of shape 
+        (player-match pairs, features), the array of (playerId, matchId) of each 
+        row and the list of the names of the features
+    """
+    event_names, sub_event_names = event_arrays['event_names'], event_arrays['sub_event_names']
+    tag2name = dict(zip(tags_names_df.Tag, tags_names_df.Description.str.lower()))
+    
+    # the feature of the event is given by the pair (eventName, subEventName)
+    is_foul = np.array([name == 'Foul' for name in event_names])[event_arrays['event_name']]
+    sub_event_name = np.where(is_foul, -1, event_arrays['sub_event_name'])
+    event_keys = event_arrays['event_name'].astype(np.int64) * (len(sub_event_names) + 1) + sub_event_name + 1
+    event_keys, event_features = np.unique(event_keys, return_inverse=True)
+    feature_names = []
+    for key in event_keys:
+        event_name, sub_event_name = divmod(key, len(sub_event_names) + 1)
+        feature_names.append(event_names[event_name] if sub_event_name == 0 else 
+                             '%s-%s' %(event_names[event_name], sub_event_names[sub_event_name - 1]))
+    
+    # one more feature for each (event feature, tag) pair
+    tag_event = np.repeat(np.arange(len(event_features)), np.diff(event_arrays['tag_ptr']))
+    tag_ids, tag_codes = np.unique(event_arrays['tag_ids'], return_inverse=True)
+    tag_keys = event_features[tag_event].astype(np.int64) * len(tag_ids) + tag_codes
+    tag_keys, tag_features = np.unique(tag_keys, return_inverse=True)
+    for key in tag_keys:
+        event_feature, tag = divmod(key, len(tag_ids))
+        feature_names.append('%s-%s' %(feature_names[event_feature], tag2name.get(tag_ids[tag], tag_ids[tag])))
+    
+    # one row per (player, match) pair
+    player_match = np.column_stack([event_arrays['player_id'], event_arrays['match_id']])
+    rows, event_rows = np.unique(player_match, axis=0, return_inverse=True)
+    event_rows = event_rows.ravel()
+    
+    row_index = np.concatenate([event_rows, event_rows[tag_event]])
+    col_index = np.concatenate([event_features, tag_features + len(event_keys)])
+    matrix = sparse.csr_matrix((np.ones(len(row_index), dtype=np.float32), (row_index, col_index)), 
+                               shape=(len(rows), len(feature_names)))
+    matrix.sum_duplicates()
+    
+    # drop the rows of the events without a player
+    with_player = rows[:, 0] != 0
+    return matrix[with_player], rows[with_player], feature_names
+
+def get_playerank_scores(feature_matrix, feature_names, weights_file='feature_weights.json'):
+    """
+    Compute the PlayeRank score of every row of the feature matrix as a single 
+    sparse matrix-vector product with the feature weights. Features without 
+    a weight are ignored.
+    
+    Parameters
+    ----------
+    feature_matrix : scipy.sparse matrix
+        the feature matrix, as returned by get_feature_matrix
+        
+    feature_names : list
+        the names of the columns of the feature matrix
+        
+    weights_file : str, optional
+        the json file with the weight of each feature. Default: 'feature_weights.json'
+        
+    Returns
+    -------
+    numpy.ndarray
+        the PlayeRank score of each row
+    """
+    with open(weights_file) as json_data:
+        feature2weight = json.load(json_data)
+    weights = np.array([feature2weight.get(name, 0.0) for name in feature_names], dtype=np.float64)
+    return feature_matrix.dot(weights)
+
+def get_passing_networks(match_events, player_id2player, team_id2team):
+    """
+    Construct the passing networks of the teams in the match: the nodes are
+    the players and the weight of an edge is the number of accurate passes
+    from the sender to the receiver.
+    
+    Parameters
+    ----------
+    match_events : list
+        the list of events of the match
+        
+    player_id2player : dict
+        a dictionary of player identifiers to players
+        
+    team_id2team : dict
+        a dictionary of team identifiers to teams
+        
+    Returns
+    -------
+    dict
+        a dictionary of team names to passing networks, as networkx objects
+    """
+    def get_name(player_id):
+        return player_id2player[player_id]['shortName'].encode('ascii', 'strict').decode('unicode-escape')
+    
+    passes = [event for event in match_events if event['eventName'] == 'Pass']
+    team2pass2weight = defaultdict(lambda: defaultdict(int))
+    for event, next_event, next_next_event in zip(passes, passes[1:], passes[2:]):
+        try:
+            if ACCURATE_PASS in [tag['id'] for tag in event['tags']]:
+                team_name = team_id2team[event['teamId']]['name']
+                sender = get_name(event['playerId'])
+                # case of duel
+                if next_event['eventName'] == 'Duel':
+                    # the receiver is the player of the same team involved in the duel
+                    receiver_event = next_event if next_event['teamId'] == event['teamId'] else next_next_event
+                    team2pass2weight[team_name][(sender, get_name(receiver_event['playerId']))] += 1
+                elif next_event['teamId'] == event['teamId']:
+                    team2pass2weight[team_name][(sender, get_name(next_event['playerId']))] += 1
+        except KeyError:
+            pass
+    
+    team2network = {}
+    for team_name, pass2weight in team2pass2weight.items():
+        G = nx.DiGraph(team=team_name)
+        for (sender, receiver), weight in pass2weight.items():
+            G.add_edge(sender, receiver, weight=weight)
+        team2network[team_name] = G
+    return team2network
+
+def get_flow_centrality(G):
+    """
+    Compute the flow centrality of the players in a passing network.
+    
+    Parameters
+    ----------
+    G : networkx object
+        the passing network
+        
+    Returns
+    -------
+    dict
+        a dictionary of player names to flow centralities, empty if the 
+        network is not connected or has less than 3 players
+    """
+    G = G.to_undirected()
+    if G.number_of_nodes() < 3 or not nx.is_connected(G):
+        return {}
+    return nx.current_flow_betweenness_centrality(G)
@@ -5,8 +5,11 @@ import pandas as pd
 import seaborn as sns
 from collections import Counter
 import numpy as np
+from functools import lru_cache
+from copy import deepcopy
 from plotly.offline import download_plotlyjs, init_notebook_mode, plot, iplot
 import plotly.graph_objs as go
+from geometry import PITCH_LENGTH, PITCH_WIDTH
 
 data_folder = 'data/'
 tags_names_df = pd.read_csv(data_folder + 'tags2name.csv')
@@ -235,7 +238,8 @@ def draw_pitch(pitch, line, orientation, view, alpha=1):
         ax.add_artist(circle3)
 
 
-def get_pitch_layout(title):
+@lru_cache(maxsize=None)
+def _get_pitch_layout():
     lines_color = 'black'
     bg_color = 'rgb(255, 255, 255)'
     pitch_layout = dict(hovermode='closest', autosize=False,
@@ -252,7 +256,6 @@ def get_pitch_layout(title):
                                             'showgrid': False,
                                             'showticklabels': False,
                                         },
-                                        title=title,
                                         shapes=[
                                             {
                                                 'type': 'circle',
@@ -404,3 +407,484 @@ def get_pitch_layout(title):
                                         ]
     )
     return pitch_layout  
+
+def get_pitch_layout(title):
+    """
+    Get the plotly layout of the soccer pitch. The shapes of the pitch are built 
+    only once and copied into each layout, which can be modified freely.
+    
+    Parameters
+    ----------
+    title : str
+        the title of the plot
+    """
+    return dict(deepcopy(_get_pitch_layout()), title=title)
+
+
+_pitch_backgrounds = {}
+
+def get_pitch_background(pitch, line, orientation, view, alpha=1, dpi=100):
+    """
+    Rasterize the soccer pitch drawn by draw_pitch once and cache the image, 
+    so that it can be reused as a background by all the following plots 
+    with the same style and orientation.
+    
+    Parameters
+    ----------
+    pitch : str
+        the color of the pitch
+        
+    line : str
+        the color of the lines
+        
+    orientation : str
+        the orientation of the pitch ('h' = horizontal, 'v' = vertical)
+        
+    view : str
+        the view of the pitch ('full' or 'half')
+        
+    alpha : float, optional
+        the transparency of the pitch color. Default: 1
+        
+    dpi : int, optional
+        the resolution of the rasterized image. Default: 100
+        
+    Returns
+    -------
+    dict
+        the RGBA image of the pitch, the figure size, the position of the axes
+        in the figure and the limits of the axes
+    """
+    key = (pitch, line, orientation[0].lower(), view[0].lower(), alpha, dpi)
+    if key not in _pitch_backgrounds:
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        
+        draw_pitch(pitch, line, orientation, view, alpha=alpha)
+        fig, ax = plt.gcf(), plt.gca()
+        fig.set_dpi(dpi)
+        canvas = FigureCanvasAgg(fig)
+        canvas.draw()
+        _pitch_backgrounds[key] = {
+            'image': np.asarray(canvas.buffer_rgba()).copy(),
+            'figsize': tuple(fig.get_size_inches()),
+            'position': ax.get_position().bounds,
+            'xlim': ax.get_xlim(),
+            'ylim': ax.get_ylim(),
+            'dpi': dpi
+        }
+        plt.close(fig)
+    return _pitch_backgrounds[key]
+
+def draw_cached_pitch(pitch, line, orientation, view, alpha=1, dpi=100):
+    """
+    Same as draw_pitch, but the pitch is pasted as a single image from the 
+    cache instead of being redrawn line by line.
+    
+    Returns
+    -------
+    tuple
+        the figure and the axes where the events can be drawn
+    """
+    background = get_pitch_background(pitch, line, orientation, view, alpha=alpha, dpi=dpi)
+    fig = plt.figure(figsize=background['figsize'], dpi=background['dpi'])
+    fig.figimage(background['image'], origin='upper', zorder=0)
+    ax = fig.add_axes(background['position'])
+    ax.set_xlim(background['xlim'])
+    ax.set_ylim(background['ylim'])
+    ax.patch.set_visible(False)
+    ax.axis('off')
+    return fig, ax
+
+class PitchRenderer(object):
+    """
+    Render many plots of events on the same cached pitch using blitting: 
+    the pitch is drawn once, then for each plot only the event layers and 
+    the title are redrawn on top of the saved background. 
+    Each layer of events is a single scatter collection.
+    
+    Parameters
+    ----------
+    layer_styles : list
+        a list of dictionaries with the keyword arguments of plt.scatter 
+        for each layer (e.g. one layer per team)
+        
+    pitch, line, orientation, view, alpha, dpi : optional
+        the style of the pitch, as in draw_pitch. 
+        Default: white pitch, black lines, horizontal, full view
+    """
+    def __init__(self, layer_styles, pitch='white', line='black', orientation='h', view='full', alpha=1, dpi=100):
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        
+        self.fig, self.ax = draw_cached_pitch(pitch, line, orientation, view, alpha=alpha, dpi=dpi)
+        self.canvas = FigureCanvasAgg(self.fig)
+        self.layers = []
+        for style in layer_styles:
+            style = dict(style)
+            style.setdefault('zorder', 12)
+            layer = self.ax.scatter(np.empty(0), np.empty(0), animated=True, **style)
+            self.layers.append(layer)
+        self.title = self.ax.set_title('', fontsize=20, animated=True)
+        self.canvas.draw()
+        self.background = self.canvas.copy_from_bbox(self.fig.bbox)
+        
+    def render(self, layers, title=''):
+        """
+        Draw the layers of events on the pitch.
+        
+        Parameters
+        ----------
+        layers : list
+            a list of (x, y) arrays, one per layer style
+        
+        title : str, optional
+            the title of the plot
+            
+        Returns
+        -------
+        numpy.ndarray
+            the RGBA image of the plot (a copy, not changed by the next plots)
+        """
+        return self._draw(layers, title).copy()
+    
+    def _draw(self, layers, title):
+        """
+        Draw the layers of events and the title on the saved background, 
+        and get a view of the canvas, overwritten by the next plot.
+        """
+        self.canvas.restore_region(self.background)
+        for layer, (x, y) in zip(self.layers, layers):
+            layer.set_offsets(np.column_stack([x, y]))
+            self.ax.draw_artist(layer)
+        self.title.set_text(title)
+        self.ax.draw_artist(self.title)
+        return np.asarray(self.canvas.buffer_rgba())
+    
+    def save(self, file_name, layers, title=''):
+        """
+        Draw the layers of events on the pitch and save the plot as PNG.
+        """
+        plt.imsave(file_name, self._draw(layers, title))
+        
+    def close(self):
+        plt.close(self.fig)
+
+TEAM_LAYER_STYLES = [
+    dict(c='red', edgecolors="k", alpha=0.5),
+    dict(marker='s', c='blue', edgecolors="w", linewidth=0.25, alpha=0.7)
+]
+
+def get_team_layers(match_events, event_name='all', orientation='h'):
+    """
+    Split the start positions of the events of a match into one layer per team.
+    The Wyscout positions (percentage of the pitch) are scaled to the metres 
+    of the pitch drawn by draw_pitch.
+    
+    Parameters
+    ----------
+    match_events : list
+        the list of events of the match
+        
+    event_name : str, optional
+        the type of the event to plot. If 'all', it plots all the events.
+        The default is 'all'.
+        
+    orientation : str, optional
+        the orientation of the pitch ('h' = horizontal, 'v' = vertical). Default: 'h'
+        
+    Returns
+    -------
+    list
+        a list of (x, y) arrays, one per team, sorted by team identifier
+    """
+    selected_events = [event for event in match_events 
+                       if event['positions'] and (event_name == 'all' or event['eventName'] == event_name)]
+    team_ids = np.array([event['teamId'] for event in selected_events])
+    x = np.array([event['positions'][0]['x'] for event in selected_events], dtype=np.float32) * PITCH_LENGTH / 100
+    y = np.array([event['positions'][0]['y'] for event in selected_events], dtype=np.float32) * PITCH_WIDTH / 100
+    if orientation.lower().startswith('v'):
+        x, y = y, x
+    return [(x[team_ids == team_id], y[team_ids == team_id]) for team_id in np.unique(team_ids)]
+
+_renderers = {}
+
+def get_render_jobs(match_id2events, match_ids, out_folder, match_id2match=None, event_name='all',
+                    orientation='h'):
+    """
+    Prepare the rendering of the events of many matches to PNG files, one file 
+    per match: the jobs can be rendered with render_match, in any process.
+    
+    Parameters
+    ----------
+    match_id2events : dict
+        a dictionary of match identifiers to the list of events of the match
+        
+    match_ids : list
+        the identifiers of the matches to render
+        
+    out_folder : str
+        the folder where the PNG files are written (<match_id>.png)
+        
+    match_id2match : dict, optional
+        a dictionary of match identifiers to matches, used for the titles
+        
+    event_name : str, optional
+        the type of the event to plot. If 'all', it plots all the events.
+        The default is 'all'.
+        
+    orientation : str, optional
+        the orientation of the pitch ('h' = horizontal, 'v' = vertical). Default: 'h'
+        
+    Returns
+    -------
+    list
+        a list of (file name, layers, title) jobs
+    """
+    import os
+    
+    os.makedirs(out_folder, exist_ok=True)
+    jobs = []
+    for match_id in match_ids:
+        title = match_id2match[match_id]['label'] if match_id2match is not None else ''
+        jobs.append((os.path.join(out_folder, '%s.png' %match_id), 
+                     get_team_layers(match_id2events[match_id], event_name=event_name, orientation=orientation), 
+                     title))
+    return jobs
+
+def render_match(job, layer_styles=TEAM_LAYER_STYLES, pitch_style=None):
+    """
+    Render a job of get_render_jobs with the non-interactive Agg backend. 
+    The PitchRenderer of each style is created at the first job of the 
+    process and reused by the following ones, so that each process 
+    draws the pitch only once.
+    
+    Parameters
+    ----------
+    job : tuple
+        the file name, the layers and the title of the plot
+        
+    layer_styles : list, optional
+        the style of each layer, one per team. Default: TEAM_LAYER_STYLES
+        
+    pitch_style : dict, optional
+        the style of the pitch, as in PitchRenderer. Default: the PitchRenderer default
+        
+    Returns
+    -------
+    str
+        the path of the PNG file
+    """
+    pitch_style = pitch_style or {}
+    key = repr((layer_styles, sorted(pitch_style.items())))
+    if key not in _renderers:
+        plt.switch_backend('Agg')
+        _renderers[key] = PitchRenderer(layer_styles, **pitch_style)
+    file_name, layers, title = job
+    _renderers[key].save(file_name, layers, title=title)
+    return file_name
+
+def render_matches(match_id2events, match_ids, out_folder, match_id2match=None, event_name='all',
+                   workers=None, layer_styles=TEAM_LAYER_STYLES, **pitch_style):
+    """
+    Render the events of many matches to PNG files, one file per match, 
+    using several worker processes with the non-interactive Agg backend. 
+    Each worker draws the pitch only once. To use an existing pool of 
+    processes, map render_match over get_render_jobs instead.
+    
+    Parameters
+    ----------
+    match_id2events : dict
+        a dictionary of match identifiers to the list of events of the match
+        
+    match_ids : list
+        the identifiers of the matches to render
+        
+    out_folder : str
+        the folder where the PNG files are written (<match_id>.png)
+        
+    match_id2match : dict, optional
+        a dictionary of match identifiers to matches, used for the titles
+        
+    event_name : str, optional
+        the type of the event to plot. If 'all', it plots all the events.
+        The default is 'all'.
+        
+    workers : int, optional
+        the number of processes. Default: the number of CPUs
+        
+    layer_styles : list, optional
+        the style of each layer, one per team. Default: TEAM_LAYER_STYLES
+        
+    Returns
+    -------
+    list
+        the paths of the PNG files
+    """
+    import os
+    from functools import partial
+    from multiprocessing import Pool
+    
+    jobs = get_render_jobs(match_id2events, match_ids, out_folder, match_id2match=match_id2match,
+                           event_name=event_name, orientation=pitch_style.get('orientation', 'h'))
+    with Pool(workers) as pool:
+        return pool.map(partial(render_match, layer_styles=layer_styles, pitch_style=pitch_style), jobs, 
+                        chunksize=max(1, len(jobs) // (4 * (workers or os.cpu_count()))))
+
+def get_event_positions(match_events):
+    """
+    Get the start positions and the types of a list of events as arrays.
+    
+    Parameters
+    ----------
+    match_events : list
+        the list of events
+        
+    Returns
+    -------
+    tuple
+        the x and y coordinates (float32) and the names of the events
+    """
+    match_events = [event for event in match_events if event['positions']]
+    x = np.array([event['positions'][0]['x'] for event in match_events], dtype=np.float32)
+    y = np.array([event['positions'][0]['y'] for event in match_events], dtype=np.float32)
+    event_names = np.array([event['eventName'] for event in match_events])
+    return x, y, event_names
+
+def decimate_events(event_codes, max_points, seed=0):
+    """
+    Select a random sample of max_points events, keeping the 
+    proportion of each type of event.
+    
+    Parameters
+    ----------
+    event_codes : numpy.ndarray
+        the integer code of the type of each event
+        
+    max_points : int
+        the maximum number of events to keep
+        
+    Returns
+    -------
+    numpy.ndarray
+        the sorted indices of the selected events
+    """
+    if len(event_codes) <= max_points:
+        return np.arange(len(event_codes))
+    rng = np.random.RandomState(seed)
+    order = np.argsort(event_codes, kind='stable')
+    counts = np.bincount(event_codes)
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    # largest remainder method: each type gets the floor of its share of max_points,
+    # the types with the largest fractional parts get the remaining points
+    shares = counts * (float(max_points) / len(event_codes))
+    n_keep = np.floor(shares).astype(int)
+    remainder = max_points - n_keep.sum()
+    n_keep[np.argsort(n_keep - shares, kind='stable')[:remainder]] += 1
+    n_keep = np.minimum(n_keep, counts)
+    selected = [rng.choice(order[start:start + count], keep, replace=False) 
+                for start, count, keep in zip(starts, counts, n_keep) if keep > 0]
+    return np.sort(np.concatenate(selected))
+
+def hexbin_events(x, y, size=2.0):
+    """
+    Aggregate the events into a grid of pointy-top hexagons.
+    
+    Parameters
+    ----------
+    x, y : numpy.ndarray
+        the coordinates of the events
+        
+    size : float, optional
+        the radius of the hexagons. Default: 2.0
+        
+    Returns
+    -------
+    tuple
+        the x and y coordinates of the centers of the non-empty hexagons 
+        and the number of events in each of them
+    """
+    # axial coordinates, rounded to the nearest hexagon in cube coordinates
+    q = (np.sqrt(3) / 3 * x - y / 3.0) / size
+    r = (2.0 / 3 * y) / size
+    s = -q - r
+    rq, rr, rs = np.round(q), np.round(r), np.round(s)
+    dq, dr, ds = np.abs(rq - q), np.abs(rr - r), np.abs(rs - s)
+    fix_q = (dq > dr) & (dq > ds)
+    fix_r = ~fix_q & (dr > ds)
+    rq[fix_q] = -rr[fix_q] - rs[fix_q]
+    rr[fix_r] = -rq[fix_r] - rs[fix_r]
+    
+    cells, counts = np.unique(np.column_stack([rq, rr]).astype(np.int32), axis=0, return_counts=True)
+    cx = size * np.sqrt(3) * (cells[:, 0] + cells[:, 1] / 2.0)
+    cy = size * 1.5 * cells[:, 1]
+    return cx.astype(np.float32), cy.astype(np.float32), counts
+
+def get_events_figure(x, y, event_names, title='', max_points=20000, aggregation='decimate', 
+                      hexbin_size=2.0, seed=0):
+    """
+    Build a plotly figure of the events on the soccer pitch, suited to a large 
+    number of events (e.g., a full season). Events are grouped in one Scattergl 
+    trace per type of event, the coordinates are passed as float32 arrays and
+    the layout of the pitch is cached. When there are more than max_points 
+    events, they are either decimated or aggregated into hexagons.
+    
+    Parameters
+    ----------
+    x, y : numpy.ndarray
+        the coordinates of the events
+        
+    event_names : numpy.ndarray
+        the type of each event
+        
+    title : str, optional
+        the title of the plot
+        
+    max_points : int, optional
+        the maximum number of events drawn as single points. Default: 20000
+        
+    aggregation : str, optional
+        what to do above max_points: 'decimate' draws a random sample of the events 
+        of each type, 'hexbin' draws one marker per hexagon sized by the number of 
+        events. Default: 'decimate'
+        
+    hexbin_size : float, optional
+        the radius of the hexagons. Default: 2.0
+        
+    Returns
+    -------
+    plotly.graph_objs.Figure
+        the figure, to be shown with iplot
+
+    Raises
+    ------
+    ValueError
+        if aggregation is not 'decimate' or 'hexbin'
+    """
+    if aggregation not in ('decimate', 'hexbin'):
+        raise ValueError("unknown aggregation %s, expected 'decimate' or 'hexbin'" %aggregation)
+    x, y = np.asarray(x, dtype=np.float32), np.asarray(y, dtype=np.float32)
+    names, codes = np.unique(event_names, return_inverse=True)
+    
+    aggregate = len(codes) > max_points and aggregation == 'hexbin'
+    if len(codes) > max_points and aggregation == 'decimate':
+        selected = decimate_events(codes, max_points, seed=seed)
+        x, y, codes = x[selected], y[selected], codes[selected]
+    
+    traces = []
+    for code, name in enumerate(names):
+        mask = codes == code
+        if aggregate:
+            cx, cy, counts = hexbin_events(x[mask], y[mask], size=hexbin_size)
+            traces.append(go.Scattergl(
+                x=cx, y=cy, mode='markers', name=str(name),
+                customdata=counts,
+                hovertemplate='%{customdata} events<extra>' + str(name) + '</extra>',
+                marker=dict(size=4 + 16 * np.sqrt(counts / float(counts.max())), 
+                            symbol='hexagon', opacity=0.7)
+            ))
+        else:
+            traces.append(go.Scattergl(
+                x=x[mask], y=y[mask], mode='markers', name=str(name),
+                hovertemplate='(%{x}, %{y})<extra>' + str(name) + '</extra>',
+                marker=dict(size=6, opacity=0.7)
+            ))
+    return go.Figure(data=traces, layout=get_pitch_layout(title))
@@ -0,0 +1,333 @@
+"""
+Command-line pipeline producing the outputs of the tutorial for a competition:
+
+    python -m report report --tournament Italy --workers 16 --out reports/Italy/
+
+The pipeline is a DAG of stages built on the functions in utils, metrics and
+plot_utils. Independent stages run concurrently and the per-match work of a
+stage is split across worker processes. A stage is skipped when its inputs
+(the data files, the code and the stages it depends on) are unchanged since
+the last run in the same output folder. The timings of the stages are written
+in timings.json.
+"""
+import argparse
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import Pool
+
+import numpy as np
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+from scipy.stats import gaussian_kde
+
+from utils import load_public_dataset, get_event_arrays, get_sorted_match_events, EVENT_TYPES, PERIODS
+from metrics import get_in_match_timelines, get_passing_networks, get_flow_centrality
+from geometry import get_event_geometry
+from ingestion import MatchState
+from plot_utils import pitch, get_render_jobs, render_match
+
+SOURCE_FILES = ['utils.py', 'metrics.py', 'plot_utils.py', 'geometry.py', 'ingestion.py', 'report.py']
+MANIFEST_FILE = 'manifest.json'
+TIMINGS_FILE = 'timings.json'
+
+def get_input_files(tournament):
+    return ['./data/events/events_%s.json' %tournament, './data/matches/matches_%s.json' %tournament,
+            './data/players.json', './data/teams.json', './data/competitions.json']
+
+# per-match work, executed in the worker processes
+
+def _match_passing_networks(job):
+    match_id, match_events, player_id2player, team_id2team = job
+    team2network = get_passing_networks(match_events, player_id2player, team_id2team)
+    return match_id, {team: [[sender, receiver, data['weight']] for sender, receiver, data in G.edges(data=True)]
+                      for team, G in team2network.items()}
+
+def _match_flow_centrality(job):
+    import networkx as nx
+
+    match_id, team2edges = job
+    player2centrality = {}
+    for edges in team2edges.values():
+        G = nx.DiGraph()
+        G.add_weighted_edges_from(edges)
+        player2centrality.update(get_flow_centrality(G))
+    return match_id, player2centrality
+
+def _match_invasion_index(job):
+    match_id, match_events = job
+    state = MatchState(match_id)
+    for event in match_events:
+        state.update(event)
+    return match_id, {str(team_id): values for team_id, values in state.team2invasion_index.items()}
+
+def _kde_map(job):
+    event_type, x, y, file_name = job
+    fig, ax = pitch()
+    if len(x) > 1:
+        xx, yy = np.mgrid[-1:101:102j, -1:101:102j]
+        density = gaussian_kde(np.vstack([x, y]))(np.vstack([xx.ravel(), yy.ravel()])).reshape(xx.shape)
+        ax.contourf(xx, yy, density, levels=10, cmap='Greens', alpha=0.8, zorder=0)
+    plt.title(event_type, fontsize=30)
+    plt.xlim(-1, 101)
+    plt.ylim(-1, 101)
+    plt.axis('off')
+    fig.tight_layout()
+    fig.savefig(file_name)
+    plt.close(fig)
+    return file_name
+
+# the stages: each one receives the pipeline and the results of its dependencies
+
+def stage_dataset(pipeline):
+    match_id2match, match_id2events, player_id2player, competition_id2competition, team_id2team = \
+        load_public_dataset(tournament=pipeline.tournament)
+    return {'match_id2match': match_id2match, 'match_id2events': match_id2events,
+            'player_id2player': player_id2player, 'team_id2team': team_id2team}
+
+def stage_event_arrays(pipeline, dataset):
+    return get_event_arrays(dataset['match_id2events'])
+
+def stage_event_frequencies(pipeline, event_arrays):
+    counts = np.bincount(event_arrays['event_name'], minlength=len(event_arrays['event_names']))
+    order = np.argsort(counts)
+    with open(pipeline.path('event_frequencies.csv'), 'w') as f:
+        f.write('eventName;events;percentage\n')
+        for i in order[::-1]:
+            f.write('%s;%s;%.2f\n' %(event_arrays['event_names'][i], counts[i], 100.0 * counts[i] / counts.sum()))
+
+    fig, ax = plt.subplots(figsize=(8, 6))
+    plt.barh([str(name) for name in event_arrays['event_names'][order]], 100.0 * counts[order] / counts.sum())
+    plt.xlabel('events (%)', fontsize=25)
+    plt.grid(alpha=0.3)
+    fig.tight_layout()
+    fig.savefig(pipeline.path('event_frequencies.png'))
+    plt.close(fig)
+
+def stage_in_match_evolution(pipeline, event_arrays):
+    timelines = get_in_match_timelines(event_arrays)
+    np.savez_compressed(pipeline.path('in_match_evolution.npz'), periods=np.array(PERIODS),
+                        tag_ids=timelines['tag_ids'], tags=timelines['tags'],
+                        event_names=timelines['event_names'].astype(str), events=timelines['events'])
+
+def stage_kde_maps(pipeline, event_arrays, sample_size=10000):
+    geometry = get_event_geometry(event_arrays)
+    rng = np.random.RandomState(0)
+    jobs = []
+    for event_type in EVENT_TYPES:
+        codes = np.where(event_arrays['event_names'] == event_type)[0]
+        selected = np.where(np.isin(event_arrays['event_name'], codes) & ~np.isnan(geometry['x_start']))[0]
+        if len(selected) > sample_size:
+            selected = rng.choice(selected, sample_size, replace=False)
+        jobs.append((event_type, geometry['x_start'][selected], geometry['y_start'][selected],
+                     pipeline.path('kde_%s.png' %event_type)))
+    pipeline.pool.map(_kde_map, jobs)
+
+def stage_passing_networks(pipeline, dataset):
+    jobs = []
+    for match_id, match_events in dataset['match_id2events'].items():
+        player_ids = set(event['playerId'] for event in match_events)
+        team_ids = set(event['teamId'] for event in match_events)
+        jobs.append((match_id, match_events,
+                     {player_id: dataset['player_id2player'][player_id] for player_id in player_ids
+                      if player_id in dataset['player_id2player']},
+                     {team_id: dataset['team_id2team'][team_id] for team_id in team_ids
+                      if team_id in dataset['team_id2team']}))
+    match_id2networks = dict(pipeline.pool.map(_match_passing_networks, jobs, chunksize=pipeline.chunksize(jobs)))
+    with open(pipeline.path('passing_networks.json'), 'w') as f:
+        json.dump({str(match_id): networks for match_id, networks in match_id2networks.items()}, f)
+    return match_id2networks
+
+def stage_flow_centrality(pipeline, passing_networks):
+    jobs = list(passing_networks.items())
+    player2centralities = defaultdict(list)
+    for match_id, player2centrality in pipeline.pool.map(_match_flow_centrality, jobs,
+                                                         chunksize=pipeline.chunksize(jobs)):
+        for player_name, centrality in player2centrality.items():
+            player2centralities[player_name].append(centrality)
+    with open(pipeline.path('flow_centrality.json'), 'w') as f:
+        json.dump(player2centralities, f)
+
+def stage_invasion_index(pipeline, dataset, event_arrays):
+    # the events of each match are sent in time order
+    jobs = [(match_id, get_sorted_match_events(dataset['match_id2events'], event_arrays, match_id))
+            for match_id in dataset['match_id2events']]
+    match_id2invasion = dict(pipeline.pool.map(_match_invasion_index, jobs, chunksize=pipeline.chunksize(jobs)))
+    with open(pipeline.path('invasion_index.json'), 'w') as f:
+        json.dump({str(match_id): invasion for match_id, invasion in match_id2invasion.items()}, f)
+
+def stage_event_maps(pipeline, dataset):
+    jobs = get_render_jobs(dataset['match_id2events'], list(dataset['match_id2events']),
+                           pipeline.path('event_maps'), match_id2match=dataset['match_id2match'])
+    pipeline.pool.map(render_match, jobs, chunksize=pipeline.chunksize(jobs))
+
+# name: (function, dependencies, outputs). Stages without outputs are kept in memory.
+STAGES = {
+    'dataset': (stage_dataset, [], []),
+    'event_arrays': (stage_event_arrays, ['dataset'], []),
+    'event_frequencies': (stage_event_frequencies, ['event_arrays'], ['event_frequencies.csv', 'event_frequencies.png']),
+    'in_match_evolution': (stage_in_match_evolution, ['event_arrays'], ['in_match_evolution.npz']),
+    'kde_maps': (stage_kde_maps, ['event_arrays'], ['kde_%s.png' %event_type for event_type in EVENT_TYPES]),
+    'passing_networks': (stage_passing_networks, ['dataset'], ['passing_networks.json']),
+    'flow_centrality': (stage_flow_centrality, ['passing_networks'], ['flow_centrality.json']),
+    'invasion_index': (stage_invasion_index, ['dataset', 'event_arrays'], ['invasion_index.json']),
+    'event_maps': (stage_event_maps, ['dataset'], ['event_maps']),
+}
+
+class Pipeline(object):
+    """
+    Run the stages of the report of a competition.
+
+    Parameters
+    ----------
+    tournament : str
+        the competition, as in utils.TOURNAMENTS
+
+    out_folder : str
+        the folder of the outputs
+
+    workers : int, optional
+        the number of worker processes. Default: the number of CPUs
+
+    force : bool, optional
+        whether to run all the stages even if their inputs are unchanged. Default: False
+    """
+    def __init__(self, tournament, out_folder, workers=None, force=False, stages=STAGES):
+        self.tournament = tournament
+        self.out_folder = out_folder
+        self.workers = workers or os.cpu_count()
+        self.force = force
+        self.stages = stages
+        self.results, self.timings = {}, {}
+        self.lock = threading.Lock()
+        self.stage_locks = {name: threading.Lock() for name in stages}
+        self.fingerprints = {}
+        self.errors = {}
+        self.pool = None
+
+        os.makedirs(out_folder, exist_ok=True)
+        manifest_file = self.path(MANIFEST_FILE)
+        self.manifest = {}
+        if os.path.exists(manifest_file):
+            with open(manifest_file) as f:
+                self.manifest = json.load(f)
+
+    def path(self, file_name):
+        return os.path.join(self.out_folder, file_name)
+
+    def chunksize(self, jobs):
+        return max(1, len(jobs) // (4 * self.workers))
+
+    def fingerprint(self, name):
+        """
+        Hash of the inputs of a stage: the data files and the code for the stages
+        without dependencies, the fingerprints of the dependencies otherwise.
+        """
+        if name not in self.fingerprints:
+            function, dependencies, outputs = self.stages[name]
+            h = hashlib.sha1(name.encode('utf-8'))
+            h.update(self.tournament.encode('utf-8'))
+            if not dependencies:
+                for file_name in get_input_files(self.tournament):
+                    if os.path.exists(file_name):
+                        stat = os.stat(file_name)
+                        h.update(('%s %s %s' %(file_name, stat.st_size, stat.st_mtime)).encode('utf-8'))
+                source_folder = os.path.dirname(os.path.abspath(__file__))
+                for file_name in SOURCE_FILES:
+                    with open(os.path.join(source_folder, file_name), 'rb') as f:
+                        h.update(f.read())
+            for dependency in dependencies:
+                h.update(self.fingerprint(dependency).encode('utf-8'))
+            self.fingerprints[name] = h.hexdigest()
+        return self.fingerprints[name]
+
+    def is_unchanged(self, name):
+        function, dependencies, outputs = self.stages[name]
+        return (not self.force and outputs and self.manifest.get(name) == self.fingerprint(name)
+                and all(os.path.exists(self.path(output)) for output in outputs))
+
+    def result(self, name):
+        """
+        Get the result of a stage, running it (and its dependencies) only once.
+        """
+        with self.stage_locks[name]:
+            if name in self.errors:
+                raise self.errors[name]
+            if name not in self.results:
+                function, dependencies, outputs = self.stages[name]
+                start = time.time()
+                try:
+                    # the dependencies are resolved concurrently
+                    with ThreadPoolExecutor(max(1, len(dependencies))) as executor:
+                        inputs = list(executor.map(self.result, dependencies))
+                    start = time.time()
+                    self.results[name] = function(self, *inputs)
+                except Exception as e:
+                    end = time.time()
+                    self.errors[name] = e
+                    with self.lock:
+                        self.timings[name] = {'status': 'failed', 'error': repr(e), 'start': start, 'end': end,
+                                              'seconds': end - start}
+                    raise
+                end = time.time()
+                with self.lock:
+                    self.timings[name] = {'status': 'run', 'start': start, 'end': end, 'seconds': end - start}
+                    if outputs:
+                        self.manifest[name] = self.fingerprint(name)
+        return self.results[name]
+
+    def run_stage(self, name):
+        if self.is_unchanged(name):
+            with self.lock:
+                self.timings[name] = {'status': 'skipped', 'seconds': 0.0}
+            return
+        try:
+            self.result(name)
+        except Exception:
+            pass # recorded in the timings, the other stages go on
+
+    def run(self):
+        """
+        Run all the stages with outputs, and write the manifest and the timings.
+        A stage that fails, and the stages depending on it, are marked as 'failed'
+        in the timings, with the error, and are not recorded in the manifest.
+        """
+        targets = [name for name, (function, dependencies, outputs) in self.stages.items() if outputs]
+        start = time.time()
+        with Pool(self.workers) as self.pool:
+            with ThreadPoolExecutor(len(targets)) as executor:
+                list(executor.map(self.run_stage, targets))
+        self.timings['total'] = {'status': 'run', 'start': start, 'end': time.time(), 'seconds': time.time() - start}
+
+        with open(self.path(MANIFEST_FILE), 'w') as f:
+            json.dump(self.manifest, f, indent=2)
+        with open(self.path(TIMINGS_FILE), 'w') as f:
+            json.dump(self.timings, f, indent=2)
+        return self.timings
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Soccer match events reports')
+    subparsers = parser.add_subparsers(dest='command')
+    report_parser = subparsers.add_parser('report', help='produce the report of a competition')
+    report_parser.add_argument('--tournament', default='Italy')
+    report_parser.add_argument('--workers', type=int, default=None)
+    report_parser.add_argument('--out', default='reports/')
+    report_parser.add_argument('--force', action='store_true', help='run all the stages')
+    args = parser.parse_args(argv)
+
+    if args.command != 'report':
+        parser.print_help()
+        return
+    timings = Pipeline(args.tournament, args.out, workers=args.workers, force=args.force).run()
+    for name, timing in sorted(timings.items(), key=lambda item: -item[1]['seconds']):
+        print('%-20s %-8s %8.2f s %s' %(name, timing['status'], timing['seconds'], timing.get('error', '')))
+    if any(timing['status'] == 'failed' for timing in timings.values()):
+        raise SystemExit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,233 @@
+import numpy as np
+from scipy.cluster.vq import kmeans2, vq
+from utils import get_weight, get_period_offsets, get_sorted_match_events
+from metrics import get_play_actions, ACTION_TYPES
+
+N_TRAJECTORY_POINTS = 8
+
+def get_action_vector(action, event_names, n_points=N_TRAJECTORY_POINTS, period_offsets=None):
+    """
+    Embed a play action into a fixed-length vector made of:
+    - the trajectory of the zone weights (get_weight) of its events, resampled
+      to n_points values
+    - its duration in seconds
+    - the histogram of the types of its events
+    - the one-hot encoding of the type of the action
+
+    Parameters
+    ----------
+    action : tuple
+        the play action, as returned by get_play_actions
+
+    event_names : list
+        the types of events counted in the histogram
+
+    n_points : int, optional
+        the number of points of the zone weight trajectory. Default: 8
+
+    period_offsets : dict, optional
+        the offset of each period of the match, as returned by utils.get_period_offsets,
+        so that the duration of an action spanning two periods is measured in seconds
+        from the start of the match. Default: get_period_offsets(action events)
+
+    Returns
+    -------
+    numpy.ndarray
+        the float32 vector of the action
+    """
+    action_type, action_events = action
+    weights = []
+    for event in action_events:
+        try:
+            weights.append(get_weight((int(event['positions'][0]['x']), int(event['positions'][0]['y']))))
+        except (IndexError, KeyError):
+            continue # skip events without position data
+    if len(weights) == 0:
+        trajectory = np.zeros(n_points)
+    else:
+        trajectory = np.interp(np.linspace(0, len(weights) - 1, n_points), np.arange(len(weights)), weights)
+
+    if period_offsets is None:
+        period_offsets = get_period_offsets(action_events)
+    duration = (action_events[-1]['eventSec'] + period_offsets[action_events[-1]['matchPeriod']]
+                - action_events[0]['eventSec'] - period_offsets[action_events[0]['matchPeriod']])
+
+    histogram = np.zeros(len(event_names))
+    name2index = {name: index for index, name in enumerate(event_names)}
+    for event in action_events:
+        if event['eventName'] in name2index:
+            histogram[name2index[event['eventName']]] += 1
+
+    action_type_vector = np.zeros(len(ACTION_TYPES))
+    if action_type in ACTION_TYPES:
+        action_type_vector[ACTION_TYPES.index(action_type)] = 1
+
+    return np.concatenate([trajectory, [duration], histogram, action_type_vector]).astype(np.float32)
+
+def get_action_vectors(match_id2events, match_ids, event_names, n_points=N_TRAJECTORY_POINTS, event_arrays=None):
+    """
+    Embed all the play actions of the input matches.
+
+    Parameters
+    ----------
+    match_id2events : dict
+        a dictionary of match identifiers to the list of events of the match
+
+    match_ids : list
+        the identifiers of the matches
+
+    event_names : list
+        the types of events counted in the histogram of each action
+
+    event_arrays : dict, optional
+        the columnar events, as returned by utils.get_event_arrays(match_id2events):
+        if given, the events of each match are taken in the precomputed time order
+        instead of being sorted by get_play_actions
+
+    Returns
+    -------
+    tuple
+        the contiguous float32 matrix of the vectors (one row per action), and for
+        each row the match identifier and the position of the action in the list
+        returned by get_play_actions
+    """
+    vectors, action_match_ids, action_positions = [], [], []
+    for match_id in match_ids:
+        period_offsets = get_period_offsets(match_id2events[match_id])
+        if event_arrays is None:
+            actions = get_play_actions(match_id2events, match_id)
+        else:
+            actions = get_play_actions({match_id: get_sorted_match_events(match_id2events, event_arrays, match_id)},
+                                       match_id, is_sorted=True)
+        for position, action in enumerate(actions):
+            if len(action[1]) == 0:
+                continue
+            vectors.append(get_action_vector(action, event_names, n_points=n_points, period_offsets=period_offsets))
+            action_match_ids.append(match_id)
+            action_positions.append(position)
+    n_features = n_points + 1 + len(event_names) + len(ACTION_TYPES)
+    vectors = np.ascontiguousarray(np.array(vectors, dtype=np.float32).reshape(-1, n_features))
+    return vectors, np.array(action_match_ids, dtype=np.int64), np.array(action_positions, dtype=np.int32)
+
+def get_match_vectors(vectors, action_match_ids):
+    """
+    Embed each match as the average vector of its play actions.
+
+    Returns
+    -------
+    tuple
+        the identifiers of the matches and the float32 matrix of their vectors
+    """
+    match_ids, rows = np.unique(action_match_ids, return_inverse=True)
+    sums = np.zeros((len(match_ids), vectors.shape[1]))
+    np.add.at(sums, rows, vectors)
+    return match_ids, (sums / np.bincount(rows)[:, None]).astype(np.float32)
+
+class VectorIndex(object):
+    """
+    Nearest-neighbour index over a matrix of vectors (e.g. play actions or matches).
+    The vectors are standardized and stored contiguously. Queries are answered
+    in batch, either exactly with blocked matrix products or approximately by
+    searching only the vectors in the n_probe clusters closest to the query
+    (inverted file over a k-means partition).
+
+    Parameters
+    ----------
+    vectors : numpy.ndarray
+        the matrix of vectors, one per row
+
+    approximate : bool, optional
+        whether to build the inverted file for approximate queries. Default: False
+
+    n_lists : int, optional
+        the number of clusters of the inverted file. Default: square root of
+        the number of vectors
+
+    block_size : int, optional
+        the number of indexed vectors compared at once with the queries. Default: 65536
+    """
+    def __init__(self, vectors, approximate=False, n_lists=None, block_size=65536, seed=0):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        self.mean = vectors.mean(axis=0)
+        self.std = vectors.std(axis=0)
+        self.std[self.std == 0] = 1.0
+        self.vectors = np.ascontiguousarray(self._standardize(vectors))
+        self.norms = np.einsum('ij,ij->i', self.vectors, self.vectors)
+        self.block_size = block_size
+        self.approximate = approximate
+
+        if approximate:
+            n_lists = n_lists or max(1, int(np.sqrt(len(self.vectors))))
+            # the clusters are trained on a sample, then every vector is assigned to the closest one
+            np.random.seed(seed)
+            sample = np.random.choice(len(self.vectors), min(len(self.vectors), 32 * n_lists), replace=False)
+            self.centroids, _ = kmeans2(self.vectors[sample], n_lists, minit='++')
+            labels, _ = vq(self.vectors, self.centroids)
+            # vectors sorted by cluster: the i-th list is order[list_ptr[i]:list_ptr[i + 1]]
+            self.order = np.argsort(labels, kind='stable')
+            self.list_ptr = np.concatenate([[0], np.cumsum(np.bincount(labels, minlength=n_lists))])
+
+    def _standardize(self, vectors):
+        return (np.asarray(vectors, dtype=np.float32) - self.mean) / self.std
+
+    def _search(self, queries, candidates, k):
+        """
+        Exact search of the k nearest candidates of each query, by blocks of candidates.
+        """
+        query_norms = np.einsum('ij,ij->i', queries, queries)
+        best_distances = np.full((len(queries), 0), np.inf, dtype=np.float32)
+        best_indices = np.empty((len(queries), 0), dtype=np.int64)
+        for start in range(0, len(candidates), self.block_size):
+            block = candidates[start:start + self.block_size]
+            distances = query_norms[:, None] - 2 * queries.dot(self.vectors[block].T) + self.norms[block][None, :]
+            distances = np.concatenate([best_distances, distances], axis=1)
+            indices = np.concatenate([best_indices, np.broadcast_to(block, (len(queries), len(block)))], axis=1)
+            if distances.shape[1] > k:
+                top = np.argpartition(distances, k - 1, axis=1)[:, :k]
+                distances = np.take_along_axis(distances, top, axis=1)
+                indices = np.take_along_axis(indices, top, axis=1)
+            best_distances, best_indices = distances, indices
+        order = np.argsort(best_distances, axis=1)
+        best_distances = np.sqrt(np.maximum(np.take_along_axis(best_distances, order, axis=1), 0))
+        return best_distances, np.take_along_axis(best_indices, order, axis=1)
+
+    def query(self, queries, k=10, n_probe=8):
+        """
+        Find the k nearest neighbours of each query vector.
+
+        Parameters
+        ----------
+        queries : numpy.ndarray
+            the matrix of query vectors, one per row, in the original (not standardized) space
+
+        k : int, optional
+            the number of neighbours. Default: 10
+
+        n_probe : int, optional
+            the number of clusters searched by approximate queries. Default: 8
+
+        Returns
+        -------
+        tuple
+            the matrices of the Euclidean distances (in the standardized space) and
+            of the row indices of the neighbours, sorted by distance
+        """
+        queries = self._standardize(np.atleast_2d(queries))
+        k = min(k, len(self.vectors))
+        if not self.approximate:
+            return self._search(queries, np.arange(len(self.vectors)), k)
+
+        # group the queries by their closest clusters
+        centroid_distances = ((queries[:, None, :] - self.centroids[None, :, :]) ** 2).sum(axis=2)
+        probes = np.argsort(centroid_distances, axis=1)[:, :n_probe]
+        distances = np.full((len(queries), k), np.inf, dtype=np.float32)
+        indices = np.full((len(queries), k), -1, dtype=np.int64)
+        probe_keys, query_groups = np.unique(np.sort(probes, axis=1), axis=0, return_inverse=True)
+        query_groups = query_groups.ravel()
+        for group, lists in enumerate(probe_keys):
+            in_group = np.where(query_groups == group)[0]
+            candidates = np.concatenate([self.order[self.list_ptr[l]:self.list_ptr[l + 1]] for l in lists])
+            found_distances, found_indices = self._search(queries[in_group], candidates, min(k, len(candidates)))
+            distances[in_group, :found_distances.shape[1]] = found_distances
+            indices[in_group, :found_indices.shape[1]] = found_indices
+        return distances, indices
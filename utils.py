@@ -94,6 +94,177 @@ def load_public_dataset(data_folder=data_folder, tournament='Italy'):
     
     return match_id2match, match_id2events, player_id2player, competition_id2competition, team_id2team
 
+PERIODS = ['1H', '2H', 'E1', 'E2', 'P']
+
+def get_event_arrays(match_id2events):
+    """
+    Convert the events of all the matches into columnar NumPy arrays, one array 
+    per field, so that metrics over the whole corpus can be computed with 
+    vectorized operations instead of loops over dictionaries.
+    The events of each match are stored contiguously, in the order of match_id2events.
+    
+    Parameters
+    ----------
+    match_id2events : dict
+        a dictionary of match identifiers to the list of events of the match
+        
+    Returns
+    -------
+    dict
+        a dictionary of arrays with one entry per event:
+        - 'id', 'match_id', 'team_id', 'player_id', 'event_id', 'sub_event_id': 
+          the identifiers of the event (-1 if missing)
+        - 'event_name', 'sub_event_name': integer codes into the arrays
+          'event_names' and 'sub_event_names'
+        - 'period': integer code into PERIODS
+        - 'event_sec': the seconds from the start of the period
+        - 'n_positions', 'position_x', 'position_y': the number of positions of the 
+          event and their coordinates, as arrays of shape (events, 2) padded with NaN
+        - 'tag_ptr', 'tag_ids': the tags of the events in CSR format, i.e., the tags 
+          of the i-th event are tag_ids[tag_ptr[i]:tag_ptr[i + 1]]
+        - 'match_ids', 'match_ptr': the matches, whose events are in the range 
+          match_ptr[j]:match_ptr[j + 1]
+        - 'abs_sec': the seconds from the start of the match, i.e. event_sec plus
+          the duration of the previous periods (see get_period_offsets)
+        - 'order': the permutation sorting the events by match and abs_sec, so that
+          the events of the j-th match in time order are order[match_ptr[j]:match_ptr[j + 1]]
+        - 'sorted_sec': abs_sec[order], non-decreasing within each match
+    """
+    period2code = {period: code for code, period in enumerate(PERIODS)}
+    event_name2code, sub_event_name2code = {}, {}
+    columns = defaultdict(list)
+    tag_ids, tag_ptr, match_ptr = [], [0], [0]
+    
+    for match_id, match_events in match_id2events.items():
+        for event in match_events:
+            columns['id'].append(event['id'])
+            columns['match_id'].append(event['matchId'])
+            columns['team_id'].append(event['teamId'])
+            columns['player_id'].append(event['playerId'])
+            columns['event_id'].append(event.get('eventId', -1))
+            sub_event_id = event.get('subEventId', -1)
+            columns['sub_event_id'].append(sub_event_id if sub_event_id != '' else -1)
+            columns['event_name'].append(event_name2code.setdefault(event['eventName'], len(event_name2code)))
+            columns['sub_event_name'].append(sub_event_name2code.setdefault(event['subEventName'], 
+                                                                            len(sub_event_name2code)))
+            columns['period'].append(period2code[event['matchPeriod']])
+            columns['event_sec'].append(event['eventSec'])
+            positions = event['positions'][:2]
+            columns['n_positions'].append(len(positions))
+            columns['position_x'].append([p['x'] for p in positions] + [np.nan] * (2 - len(positions)))
+            columns['position_y'].append([p['y'] for p in positions] + [np.nan] * (2 - len(positions)))
+            tag_ids.extend(tag['id'] for tag in event['tags'])
+            tag_ptr.append(len(tag_ids))
+        match_ptr.append(match_ptr[-1] + len(match_events))
+    
+    dtypes = {'id': np.int64, 'match_id': np.int64, 'team_id': np.int64, 'player_id': np.int64,
+              'event_id': np.int32, 'sub_event_id': np.int32, 'event_name': np.int16,
+              'sub_event_name': np.int16, 'period': np.int8, 'event_sec': np.float64,
+              'n_positions': np.int8, 'position_x': np.float32, 'position_y': np.float32}
+    event_arrays = {name: np.array(columns[name], dtype=dtype) for name, dtype in dtypes.items()}
+    event_arrays['event_names'] = np.array(list(event_name2code), dtype=object)
+    event_arrays['sub_event_names'] = np.array(list(sub_event_name2code), dtype=object)
+    event_arrays['tag_ids'] = np.array(tag_ids, dtype=np.int32)
+    event_arrays['tag_ptr'] = np.array(tag_ptr, dtype=np.int64)
+    event_arrays['match_ids'] = np.array(list(match_id2events), dtype=np.int64)
+    event_arrays['match_ptr'] = np.array(match_ptr, dtype=np.int64)
+    
+    # the duration of a period is the time of its last event
+    match_index = get_match_index(event_arrays)
+    period_keys = match_index * len(PERIODS) + event_arrays['period']
+    period_ends = np.zeros(len(match_ptr) * len(PERIODS))
+    np.maximum.at(period_ends, period_keys, event_arrays['event_sec'])
+    period_ends = period_ends.reshape(-1, len(PERIODS))
+    period_offsets = np.cumsum(period_ends, axis=1) - period_ends
+    event_arrays['abs_sec'] = event_arrays['event_sec'] + period_offsets.ravel()[period_keys]
+    event_arrays['order'] = np.lexsort((event_arrays['abs_sec'], match_index))
+    event_arrays['sorted_sec'] = event_arrays['abs_sec'][event_arrays['order']]
+    return event_arrays
+
+def get_match_index(event_arrays):
+    """
+    Get, for each event, the position of its match in event_arrays['match_ids'].
+    """
+    return np.repeat(np.arange(len(event_arrays['match_ids'])), np.diff(event_arrays['match_ptr']))
+
+def get_period_offsets(events_match):
+    """
+    Get the offset to add to the eventSec of the events of each period to obtain 
+    the seconds from the start of the match: the duration of a period is the 
+    eventSec of its last event.
+    
+    Parameters
+    ----------
+    events_match : list
+        the list of events of the match
+        
+    Returns
+    -------
+    dict
+        a dictionary of periods to offsets
+    """
+    period_ends = defaultdict(float)
+    for event in events_match:
+        period_ends[event['matchPeriod']] = max(period_ends[event['matchPeriod']], event['eventSec'])
+    period_offsets, offset = {}, 0.0
+    for period in PERIODS:
+        period_offsets[period] = offset
+        offset += period_ends[period]
+    return period_offsets
+
+def get_events_in_window(event_arrays, match_id, start, end):
+    """
+    Get the events of a match occurring in a time window, with a binary search
+    on the sorted times of the match.
+    
+    Parameters
+    ----------
+    event_arrays : dict
+        the columnar events, as returned by get_event_arrays
+        
+    match_id : int
+        the identifier of the match
+        
+    start, end : float
+        the time window [start, end), in seconds from the start of the match 
+        (e.g. 3600, 4500 for minutes 60-75)
+        
+    Returns
+    -------
+    numpy.ndarray
+        the positions of the events in the arrays, in time order
+    """
+    match = np.where(event_arrays['match_ids'] == match_id)[0][0]
+    first, last = event_arrays['match_ptr'][match], event_arrays['match_ptr'][match + 1]
+    low, high = np.searchsorted(event_arrays['sorted_sec'][first:last], [start, end], side='left')
+    return event_arrays['order'][first + low:first + high]
+
+def get_sorted_match_events(match_id2events, event_arrays, match_id):
+    """
+    Get the events of a match in time order, using the order precomputed by 
+    get_event_arrays instead of sorting them again.
+    
+    Parameters
+    ----------
+    match_id2events : dict
+        a dictionary of match identifiers to the list of events of the match
+        
+    event_arrays : dict
+        the columnar events, as returned by get_event_arrays(match_id2events)
+        
+    match_id : int
+        the identifier of the match
+        
+    Returns
+    -------
+    list
+        the events of the match, sorted by seconds from the start of the match
+    """
+    match = np.where(event_arrays['match_ids'] == match_id)[0][0]
+    first, last = event_arrays['match_ptr'][match], event_arrays['match_ptr'][match + 1]
+    match_events = match_id2events[match_id]
+    return [match_events[index] for index in event_arrays['order'][first:last] - first]
+
 def get_weight(position):
     """
     Get the probability of scoring a goal given the position of the field where 
@@ -131,8 +302,97 @@ def get_weight(position):
     return 0.0
 
 
+def get_weights(x, y):
+    """
+    Vectorized version of get_weight: get the probability of scoring a goal 
+    given the positions of the field where the events are generated.
+    
+    Parameters
+    ----------
+    x, y: numpy.ndarray
+        the coordinates of the events
+        
+    Returns
+    -------
+    numpy.ndarray
+        the weight of each position
+    """
+    x, y = np.asarray(x), np.asarray(y)
+    # the conditions are checked in the same order as in get_weight
+    conditions = [
+        (x >= 65) & (x <= 75),
+        (x > 75) & (x <= 85) & (y >= 15) & (y <= 85),
+        (x > 85) & (y >= 15) & (y <= 25) | (y >= 75) & (y <= 85),
+        (x > 75) & ((y <= 15) | (y >= 85)),
+        (x > 85) & (y >= 40) & (y <= 60),
+        (x > 85) & ((y >= 25) & (y <= 40) | (y >= 60) & (y <= 85))
+    ]
+    return np.select(conditions, [0.01, 0.5, 0.5, 0.02, 1.0, 0.8], default=0.0)
+
+
+WEIGHT_GRID_FILE = data_folder + 'weight_grid.npz'
+_weight_grids = {}
+
+def load_weight_grid(file_name=WEIGHT_GRID_FILE):
+    """
+    Load a grid of scoring probabilities, as saved by expected_goals.save_weight_grid.
+    
+    Parameters
+    ----------
+    file_name : str, optional
+        the .npz file with the arrays 'grid' (shape (n_x, n_y)), 'x_edges' and 'y_edges'. 
+        Default: 'data/weight_grid.npz'
+        
+    Returns
+    -------
+    dict
+        the grid and the edges of its cells
+    """
+    if file_name not in _weight_grids:
+        with np.load(file_name) as data:
+            _weight_grids[file_name] = {name: data[name] for name in ['grid', 'x_edges', 'y_edges']}
+    return _weight_grids[file_name]
+
+def get_datadriven_weights(x, y, weight_grid=None):
+    """
+    Data-driven version of get_weights: get the probability of scoring a goal 
+    given the positions of the field, from a grid fitted on the shots.
+    
+    Parameters
+    ----------
+    x, y: numpy.ndarray
+        the coordinates of the events
+        
+    weight_grid : dict, optional
+        the grid, as returned by load_weight_grid. Default: load_weight_grid()
+        
+    Returns
+    -------
+    numpy.ndarray
+        the weight of each position (0.0 for missing positions, i.e. NaN coordinates)
+    """
+    weight_grid = load_weight_grid() if weight_grid is None else weight_grid
+    grid = weight_grid['grid']
+    x, y = np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64)
+    is_valid = np.isfinite(x) & np.isfinite(y)
+    i = np.clip(np.searchsorted(weight_grid['x_edges'], x, side='right') - 1, 0, grid.shape[0] - 1)
+    j = np.clip(np.searchsorted(weight_grid['y_edges'], y, side='right') - 1, 0, grid.shape[1] - 1)
+    return np.where(is_valid, grid[i, j], 0.0)
+
+def get_datadriven_weight(position, weight_grid=None):
+    """
+    Data-driven version of get_weight, for a single position.
+    
+    Parameters
+    ----------
+    position: tuple
+        the x,y coordinates of the event
+    """
+    x, y = position
+    return float(get_datadriven_weights(np.array([x]), np.array([y]), weight_grid)[0])
+
 def in_window(events_match, time_window):
-    start, end = events_match[0], events[-1]
+    start, end = events_match[0], events_match[-1]
     return start['eventSec'] >= time_window[0] and end['eventSec'] <= time_window[1]
 
 